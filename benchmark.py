@@ -0,0 +1,288 @@
+# Офлайн-бенчмарк основных операций planning_app.py на локальном хранилище (local_backend.py):
+# без GCP, сети и браузера. Для каждого размера листа и числа команд засекаются:
+#
+#   mirror_sync     полная загрузка листа в пустое SQLite-зеркало
+#   load_data       разбор зеркала в типизированный фрейм (кэш по версии сброшен)
+#   save_rows       сохранение задачи с двумя зависимостями (блокировка, хвост листа, запись)
+#   save_sync       сверка зеркала после сохранения, рядом с которым была чужая правка: ревизию
+#                   сдвинуть нельзя, лист скачивается и сверяется по хэшам строк
+#   p0_downgrade    проверка P0 команды по индексу + понижение старого P0
+#   jira_full       sync_jira_sheet с нуля (пустая вкладка csv)
+#   jira_incr       sync_jira_sheet после одного сохранения
+#   analytics       update_analytics_tab
+#   dashboard       агрегат нагрузки + фигура графика (кэши сброшены)
+#   schedule_full   даты для задачи с двумя блокерами, план квартала строится с нуля
+#   schedule_incr   то же после одного сохранения: план обновляется по диффу
+#
+# Время — медиана по --repeat запусков; API — число вызовов Sheets (чтение/запись) за один запуск;
+# память — пик tracemalloc за отдельный запуск (без него время не искажается).
+#
+# Запуск: python benchmark.py [--sizes 100 1000 10000 50000] [--departments 7 50] [--repeat 3] [--json results.json]
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+_WORKDIR = tempfile.mkdtemp(prefix="planning_bench_")
+os.environ["PLANNING_STORAGE_BACKEND"] = "local"
+os.environ["PLANNING_LOCAL_STORE"] = ""
+os.environ["PLANNING_MIRROR_DB"] = os.path.join(_WORKDIR, "mirror.sqlite")
+os.environ.setdefault("PLANNING_LOG_LEVEL", "WARNING")
+
+import pandas as pd
+import streamlit as st
+
+import planning_app as app
+
+OPERATIONS = ["mirror_sync", "load_data", "save_rows", "save_sync", "p0_downgrade", "jira_full", "jira_incr", "analytics", "dashboard",
+              "schedule_full", "schedule_incr"]
+BASE_DEPARTMENTS = list(app.DEPARTMENTS)
+
+
+def quiet_streamlit():
+    # Вне `streamlit run` кэши Streamlit предупреждают об отсутствии рантайма на каждый вызов
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+
+def make_departments(count):
+    return (BASE_DEPARTMENTS + [f"Team {i:02d}" for i in range(len(BASE_DEPARTMENTS) + 1, count + 1)])[:count]
+
+
+def make_rows(n_rows, departments, rng):
+    rows = []
+    today = pd.Timestamp.today().normalize()
+    for i in range(n_rows):
+        sheet_row = i + 2
+        executor = departments[i % len(departments)]
+        # У каждой команды ровно один активный P0 — первая её строка
+        priority = "P0 (Critical)" if i < len(departments) else rng.choice(app.PRIORITIES[1:])
+        task_type = "Own Task" if i < len(departments) else rng.choice(["Own Task"] * 7 + app.TASK_TYPES[1:])
+        start = today + pd.Timedelta(days=rng.randint(-120, 120))
+        sp = rng.choice(app.SP_OPTIONS)
+        rows.append([
+            "TRUE" if rng.random() < 0.9 else "FALSE",
+            f"Задача {i}",
+            "Описание задачи, критерии приёмки и ссылки. " * rng.randint(1, 6),
+            rng.choice(departments),
+            executor,
+            rng.choice(app.CLIENTS),
+            priority,
+            app.rice_formula(sheet_row),
+            sp if task_type == "Own Task" else "",
+            rng.randint(1, 10),
+            rng.randint(1, 5),
+            rng.choice(["100%", "80%", "50%"]),
+            task_type,
+            start.strftime("%Y-%m-%d") if task_type == "Own Task" else "",
+            (start + pd.Timedelta(days=sp)).strftime("%Y-%m-%d"),
+            f"T-bench{i:07d}",
+            "",
+        ])
+    return rows
+
+
+def form_rows(team, dep_teams, start="2026-01-05", end="2026-01-08"):
+    def row(name, executor, task_type, sp):
+        return pd.DataFrame([{
+            'Берем': 'TRUE', 'Название задачи': name, 'Описание': "Бенчмарк", 'Кто создал задачу': team,
+            'Исполнитель': executor, 'Заказчик': app.CLIENTS[0], 'Приоритет': "P2 (Medium)", 'RICE': "",
+            'Оценка (SP)': sp, 'Reach': 5, 'Impact': 3, 'Confidence': "80%", 'Тип': task_type,
+            'Start date': start if task_type == "Own Task" else "", 'End date': end if task_type == "Own Task" else "",
+            'ID': app.new_task_id(), 'Автодаты': "",
+        }])
+    return [row("Новая задача", team, "Own Task", 3)] + [row(f"Зависимость для {team}", dep, "Incoming Blocker", "") for dep in dep_teams]
+
+
+class Scenario:
+    def __init__(self, n_rows, n_departments, seed=42):
+        self.n_rows = n_rows
+        self.rng = random.Random(seed)
+        self.departments = make_departments(n_departments)
+        self.capacity = {dept: {'people': 5, 'days': 21, 'overhead': 20} for dept in self.departments}
+        self.counter = 0
+
+        # Список команд в модуле меняется на месте: на него ссылаются и справочники типизации
+        app.DEPARTMENTS[:] = self.departments
+        app.MIRROR_DB_PATH = os.path.join(_WORKDIR, f"mirror_{n_rows}_{n_departments}.sqlite")
+        self.drop_mirror()
+        app.reset_connection()
+        app.get_spreadsheet.clear()  # хранилище без файла: новая пустая таблица на сценарий
+        st.session_state.capacity_settings = self.capacity
+
+        sheet = app.get_main_sheet()
+        sheet.update(range_name="A1", values=[app.EXPECTED_COLS] + make_rows(n_rows, self.departments, self.rng),
+                     value_input_option="USER_ENTERED")
+        app.save_capacity_settings(self.capacity)
+        app.sync_mirror(force=True)
+
+    def drop_mirror(self):
+        app._mirror_state.clear()
+        for suffix in ("", "-wal", "-shm"):
+            path = app.MIRROR_DB_PATH + suffix
+            if os.path.exists(path):
+                os.remove(path)
+
+    # --- подготовка (не входит в замер) и сами операции ---
+    def setup_mirror_sync(self):
+        self.drop_mirror()
+
+    def op_mirror_sync(self, _):
+        app.sync_mirror(force=True)
+
+    def setup_load_data(self):
+        app.load_tasks.clear()
+
+    def op_load_data(self, _):
+        app.load_data()
+
+    def setup_save_rows(self):
+        self.counter += 1
+        team = self.departments[self.counter % len(self.departments)]
+        deps = [d for d in self.departments if d != team][:2]
+        return form_rows(team, deps)
+
+    def op_save_rows(self, rows):
+        app.save_rows(rows)
+
+    def setup_save_sync(self):
+        app.sync_mirror(force=True)
+        # Правка другого участника прямо в таблице, затем наше сохранение
+        self.counter += 1
+        app.get_main_sheet().update_cell(2 + self.counter % self.n_rows, 2, f"Задача, правка {self.counter}")
+        app.save_rows(self.setup_save_rows())
+
+    def op_save_sync(self, _):
+        if not app.sync_mirror():
+            raise RuntimeError("сверка после чужой правки ничего не подтянула")
+
+    def setup_p0_downgrade(self):
+        team = self.departments[0]
+        if app.find_active_p0_row(team) is None:
+            app.get_main_sheet().update_cell(2, 7, "P0 (Critical)")
+            app.mirror_set_priority(2, "P0 (Critical)")
+        return team
+
+    def op_p0_downgrade(self, team):
+        app.downgrade_existing_p0(team, app.find_active_p0_row(team))
+
+    def setup_jira_full(self):
+        app.get_worksheet("csv").clear()
+        return app.load_data()
+
+    def op_jira_full(self, df):
+        app.sync_jira_sheet(df)
+
+    def setup_jira_incr(self):
+        app.sync_jira_sheet(app.load_data())
+        app.save_rows(self.setup_save_rows()[:1])
+        return app.load_data()
+
+    def op_jira_incr(self, df):
+        app.sync_jira_sheet(df)
+
+    def setup_analytics(self):
+        app.load_workload.clear()
+
+    def op_analytics(self, _):
+        app.update_analytics_tab(self.capacity, app.CLIENTS)
+
+    def setup_dashboard(self):
+        app.load_workload.clear()
+        app.build_workload_figure.clear()
+
+    def op_dashboard(self, _):
+        app.build_workload_figure(app.mirror_version(), app.capacity_key(self.capacity))
+
+    def schedule_values(self):
+        team = self.departments[self.counter % len(self.departments)]
+        deps = [d for d in self.departments if d != team][:2]
+        return [row_df.values.tolist()[0] for row_df in form_rows(team, deps, start="", end="")]
+
+    def setup_schedule_full(self):
+        app._schedule_cache.clear()
+        app.load_tasks(app.mirror_version())
+        return self.schedule_values()
+
+    def op_schedule_full(self, values):
+        app.schedule_new_rows(values, self.capacity)
+
+    def setup_schedule_incr(self):
+        app.schedule_new_rows(self.schedule_values(), self.capacity)
+        app.save_rows(self.setup_save_rows()[:1])
+        app.load_tasks(app.mirror_version())
+        return self.schedule_values()
+
+    def op_schedule_incr(self, values):
+        app.schedule_new_rows(values, self.capacity)
+
+    def measure(self, name, repeat):
+        setup = getattr(self, f"setup_{name}")
+        op = getattr(self, f"op_{name}")
+
+        times = []
+        for _ in range(repeat):
+            state = setup()
+            t0 = time.perf_counter()
+            op(state)
+            times.append((time.perf_counter() - t0) * 1000)
+
+        state = setup()
+        trace = app.start_trace(f"benchmark:{name}")
+        tracemalloc.start()
+        op(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        app.finish_trace(trace, keep=False)
+
+        return {
+            'operation': name, 'rows': self.n_rows, 'departments': len(self.departments),
+            'ms': round(statistics.median(times), 2),
+            'api_reads': sum(1 for call in trace['api'] if call['kind'] in ("read", "lock")),
+            'api_writes': sum(1 for call in trace['api'] if call['kind'] not in ("read", "lock")),
+            'peak_mb': round(peak / 2 ** 20, 2),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк planning_app на локальном хранилище")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--departments", type=int, nargs="+", default=[7, 50])
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    quiet_streamlit()
+    # Фоновая синхронизация вкладок в бенчмарке не запускается: она исказила бы замеры соседних операций.
+    # Сверку зеркала после сохранения засекает отдельная операция save_sync
+    app.request_derived_sync = lambda capacity_settings: None
+
+    results = []
+    for n_departments in args.departments:
+        for n_rows in args.sizes:
+            t0 = time.perf_counter()
+            scenario = Scenario(n_rows, n_departments)
+            print(f"# {n_rows} строк, {n_departments} команд (подготовка {time.perf_counter() - t0:.1f} с)", flush=True)
+            for name in args.operations:
+                result = scenario.measure(name, args.repeat)
+                results.append(result)
+                print(f"  {name:<14} {result['ms']:>10.1f} мс   API r/w {result['api_reads']:>3}/{result['api_writes']:<3}"
+                      f"   пик {result['peak_mb']:>8.2f} МБ", flush=True)
+
+    print()
+    print(pd.DataFrame(results).pivot_table(index=['departments', 'rows'], columns='operation', values='ms')[args.operations]
+          .round(1).to_string())
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Индекс графа зависимостей для planning_app.py: рёбра "блокер -> задача" по стабильным ID задач.
+#
+#   build_index(edges)                  смежность в обе стороны, edges — (blocker_id, task_id, kind)
+#   add_edge / creates_cycle            вставка ребра и проверка, не замкнёт ли оно цикл
+#   downstream / upstream               все задачи, транзитивно заблокированные задачей (или блокирующие её)
+#   find_cycles                         задачи в циклах и за ними — их нельзя упорядочить (связи правили руками)
+#   path_metrics                        ранние/поздние сроки и резерв (slack) по методу критического пути
+#   critical_path                       самая длинная цепочка, заканчивающаяся на задачах команды
+#
+# Сроки считаются в днях по длительностям задач; вершины в циклах в расчёт не входят.
+import collections
+
+HARD_KINDS = ('Incoming Blocker',)  # энейблер помогает, но не держит старт задачи
+
+
+def build_index(edges):
+    index = {'succ': collections.defaultdict(dict), 'pred': collections.defaultdict(dict)}
+    for blocker, task, kind in edges:
+        add_edge(index, blocker, task, kind)
+    return index
+
+
+def add_edge(index, blocker, task, kind):
+    index['succ'][blocker][task] = kind
+    index['pred'][task][blocker] = kind
+
+
+def _neighbours(adjacency, node, kinds):
+    return [other for other, kind in adjacency.get(node, {}).items() if kinds is None or kind in kinds]
+
+
+def _reachable(adjacency, start, kinds):
+    seen = set()
+    stack = _neighbours(adjacency, start, kinds)
+    while stack:
+        node = stack.pop()
+        if node not in seen:
+            seen.add(node)
+            stack.extend(_neighbours(adjacency, node, kinds))
+    return seen
+
+
+def downstream(index, task, kinds=HARD_KINDS):
+    return _reachable(index['succ'], task, kinds)
+
+
+def upstream(index, task, kinds=HARD_KINDS):
+    return _reachable(index['pred'], task, kinds)
+
+
+# Любая связь (и блокер, и энейблер) не должна замыкать цикл: такой план невозможно упорядочить
+def creates_cycle(index, blocker, task):
+    return blocker == task or blocker in _reachable(index['succ'], task, None)
+
+
+def _topological_order(index, nodes, kinds):
+    indegree = {node: 0 for node in nodes}
+    for node in nodes:
+        for other in _neighbours(index['succ'], node, kinds):
+            if other in indegree:
+                indegree[other] += 1
+    queue = collections.deque(node for node, degree in indegree.items() if degree == 0)
+    order = []
+    while queue:
+        node = queue.popleft()
+        order.append(node)
+        for other in _neighbours(index['succ'], node, kinds):
+            if other in indegree:
+                indegree[other] -= 1
+                if indegree[other] == 0:
+                    queue.append(other)
+    return order
+
+
+def find_cycles(index, kinds=None):
+    nodes = set(index['succ']) | set(index['pred'])
+    return nodes - set(_topological_order(index, nodes, kinds))
+
+
+# durations: {task_id: дни}. Задачи без связей тоже входят — их резерв равен запасу до конца плана.
+# Возвращает {task_id: {'es', 'ef', 'ls', 'lf', 'slack'}}; horizon по умолчанию — самый поздний ранний финиш.
+def path_metrics(index, durations, horizon=None, kinds=HARD_KINDS):
+    order = _topological_order(index, durations, kinds)
+    es, ef = {}, {}
+    for node in order:
+        es[node] = max((ef[b] for b in _neighbours(index['pred'], node, kinds) if b in ef), default=0)
+        ef[node] = es[node] + durations[node]
+    if horizon is None:
+        horizon = max(ef.values(), default=0)
+
+    metrics = {}
+    for node in reversed(order):
+        lf = min((metrics[t]['ls'] for t in _neighbours(index['succ'], node, kinds) if t in metrics), default=horizon)
+        ls = lf - durations[node]
+        metrics[node] = {'es': es[node], 'ef': ef[node], 'ls': ls, 'lf': lf, 'slack': ls - es[node]}
+    return metrics
+
+
+# Цепочка от первого блокера до задачи команды с самым поздним ранним финишем:
+# на каждом шаге назад берётся предшественник, финиш которого и задаёт ранний старт
+def critical_path(index, metrics, team_tasks, kinds=HARD_KINDS):
+    candidates = [t for t in team_tasks if t in metrics]
+    if not candidates:
+        return []
+    node = max(candidates, key=lambda t: metrics[t]['ef'])
+    path = [node]
+    while True:
+        critical = [b for b in _neighbours(index['pred'], node, kinds)
+                    if b in metrics and metrics[b]['ef'] == metrics[node]['es']]
+        if not critical:
+            break
+        node = max(critical, key=lambda b: metrics[b]['ef'])
+        path.append(node)
+    return path[::-1]
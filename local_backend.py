@@ -0,0 +1,622 @@
+# Локальная замена Google Sheets для planning_app.py: таблица в памяти (или в JSON-файле)
+# с тем же подмножеством API gspread, которым пользуется приложение:
+#
+#   Spreadsheet: title, sheet1, worksheet(), add_worksheet(), worksheets(), get_lastUpdateTime(),
+#                batch_update() (только deleteDimension по строкам)
+#   Worksheet:   title, id, row_count, col_count, get_all_values(), get_values(), col_values(),
+#                update(), update_cell(), batch_update(), batch_clear(), add_rows(), delete_rows(),
+#                clear(), append_row(), append_rows()
+#
+# Значения хранятся типизированно, как после USER_ENTERED в Sheets ("TRUE" -> bool, "80%" -> число
+# с процентным форматом, "=..." -> формула), а при чтении формулы вычисляются. Поддержан ровно тот
+# диалект, который пишет приложение: IFERROR, ROUND, SUMIFS (равенство, регистр не важен),
+# арифметика, ссылки на ячейки, диапазоны и целые колонки, в т.ч. на другие листы; разделитель ";" или ",".
+#
+# Включается переменными окружения:
+#   PLANNING_STORAGE_BACKEND=local  PLANNING_LOCAL_STORE=planning_local.json  (пусто -> только память)
+import datetime
+import json
+import os
+import re
+import threading
+
+import gspread
+
+
+class _Formula(str):
+    pass
+
+
+class _Percent(float):
+    pass
+
+
+class FormulaError(Exception):
+    pass
+
+
+def col_to_num(letters):
+    num = 0
+    for ch in letters:
+        num = num * 26 + ord(ch) - 64
+    return num
+
+
+def num_to_col(num):
+    letters = ""
+    while num > 0:
+        num, rem = divmod(num - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+_CELL_RE = re.compile(r"^([A-Z]*)(\d*)$")
+
+
+def parse_range(a1):
+    # "A1", "B3:B", "A1:M", "I:I", "H1:I" -> (row1, col1, row2, col2); None = до конца листа
+    a1 = a1.split("!")[-1].replace("$", "")
+    start, _, end = a1.partition(":")
+    m1 = _CELL_RE.match(start)
+    r1 = int(m1.group(2)) if m1.group(2) else 1
+    c1 = col_to_num(m1.group(1)) if m1.group(1) else 1
+    if not end:
+        if m1.group(2):
+            return r1, c1, r1, c1
+        return r1, c1, None, c1
+    m2 = _CELL_RE.match(end)
+    r2 = int(m2.group(2)) if m2.group(2) else None
+    c2 = col_to_num(m2.group(1)) if m2.group(1) else None
+    return r1, c1, r2, c2
+
+
+def _parse_user_entered(value):
+    if value is None:
+        return None
+    if isinstance(value, (bool, int, float)):
+        return value
+    text = str(value)
+    if text == "":
+        return None
+    if text.startswith("="):
+        return _Formula(text)
+    if text.upper() in ("TRUE", "FALSE"):
+        return text.upper() == "TRUE"
+    try:
+        if text.endswith("%"):
+            return _Percent(float(text[:-1].replace(",", ".")) / 100.0)
+        return float(text.replace(",", ".")) if re.fullmatch(r"-?\d+([.,]\d+)?", text) else text
+    except ValueError:
+        return text
+
+
+def _parse_raw(value):
+    if value is None or value == "":
+        return None
+    return value
+
+
+def format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, _Percent):
+        return f"{value * 100:g}%"
+    if isinstance(value, (int, float)):
+        if float(value).is_integer():
+            return str(int(value))
+        return f"{value:.10g}"
+    return str(value)
+
+
+class LocalWorksheet:
+    def __init__(self, spreadsheet, title, rows=1000, cols=26, sheet_id=0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.row_count = rows
+        self.col_count = cols
+        self._rows = []
+
+    # --- хранение ---
+    def _set(self, row, col, value):
+        while len(self._rows) < row:
+            self._rows.append([])
+        cells = self._rows[row - 1]
+        if value is None and len(cells) < col:
+            return
+        while len(cells) < col:
+            cells.append(None)
+        cells[col - 1] = value
+        self.row_count = max(self.row_count, row)
+        self.col_count = max(self.col_count, col)
+
+    def _raw(self, row, col):
+        if row > len(self._rows):
+            return None
+        cells = self._rows[row - 1]
+        return cells[col - 1] if col <= len(cells) else None
+
+    def _last_row(self):
+        for i in range(len(self._rows) - 1, -1, -1):
+            if any(v is not None for v in self._rows[i]):
+                return i + 1
+        return 0
+
+    def _write_block(self, start_a1, values, parse):
+        r1, c1, _, _ = parse_range(start_a1)
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                self._set(r1 + i, c1 + j, parse(value))
+        last_row = r1 + len(values) - 1
+        last_col = c1 + max((len(r) for r in values), default=1) - 1
+        return f"'{self.title}'!{num_to_col(c1)}{r1}:{num_to_col(last_col)}{last_row}"
+
+    def _read_block(self, a1, evaluator):
+        r1, c1, r2, c2 = parse_range(a1)
+        last_row = self._last_row()
+        r2 = last_row if r2 is None else min(r2, last_row)
+        c2 = min(c2 or self.col_count, max((len(r) for r in self._rows), default=0))
+        out = []
+        for r in range(r1, r2 + 1):
+            out.append([format_value(evaluator.value(self, r, c)) for c in range(c1, c2 + 1)])
+        while out and not any(out[-1]):
+            out.pop()
+        width = max((max((j + 1 for j, v in enumerate(row) if v), default=0) for row in out), default=0)
+        return [row[:width] for row in out]
+
+    # --- чтение ---
+    def get_all_values(self, **kwargs):
+        with self.spreadsheet.lock:
+            return self._read_block("A1:ZZ", _Evaluator(self.spreadsheet))
+
+    def get_values(self, range_name=None, **kwargs):
+        with self.spreadsheet.lock:
+            return self._read_block(range_name or "A1:ZZ", _Evaluator(self.spreadsheet))
+
+    def col_values(self, col, **kwargs):
+        with self.spreadsheet.lock:
+            evaluator = _Evaluator(self.spreadsheet)
+            values = [format_value(evaluator.value(self, r, col)) for r in range(1, self._last_row() + 1)]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    # --- запись ---
+    def update(self, values=None, range_name=None, value_input_option=None, **kwargs):
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        parse = _parse_user_entered if value_input_option == "USER_ENTERED" else _parse_raw
+        with self.spreadsheet.lock:
+            updated = self._write_block(range_name or "A1", values, parse)
+            self.spreadsheet._touch()
+        return {"updatedRange": updated}
+
+    def update_cell(self, row, col, value):
+        with self.spreadsheet.lock:
+            self._set(row, col, _parse_user_entered(value))
+            self.spreadsheet._touch()
+
+    def batch_update(self, data, value_input_option=None, **kwargs):
+        parse = _parse_user_entered if value_input_option == "USER_ENTERED" else _parse_raw
+        with self.spreadsheet.lock:
+            for item in data:
+                self._write_block(item["range"], item["values"], parse)
+            self.spreadsheet._touch()
+
+    def batch_clear(self, ranges):
+        with self.spreadsheet.lock:
+            for a1 in ranges:
+                r1, c1, r2, c2 = parse_range(a1)
+                r2 = len(self._rows) if r2 is None else min(r2, len(self._rows))
+                for r in range(r1, r2 + 1):
+                    cells = self._rows[r - 1]
+                    for c in range(c1, min(c2 or len(cells), len(cells)) + 1):
+                        cells[c - 1] = None
+            self.spreadsheet._touch()
+
+    def add_rows(self, rows):
+        with self.spreadsheet.lock:
+            self.row_count += rows
+            self.spreadsheet._touch()
+
+    def delete_rows(self, start_index, end_index=None):
+        end_index = start_index if end_index is None else end_index
+        with self.spreadsheet.lock:
+            self._delete_rows(start_index, end_index)
+            self.spreadsheet._touch()
+
+    # Как в Sheets: ссылки формул (на этом и на других листах) на строки ниже удалённых сдвигаются вверх
+    def _delete_rows(self, start_index, end_index):
+        del self._rows[start_index - 1:end_index]
+        self.row_count = max(self.row_count - (end_index - start_index + 1), 1)
+        for ws in self.spreadsheet._sheets:
+            for cells in ws._rows:
+                for i, value in enumerate(cells):
+                    if isinstance(value, _Formula):
+                        cells[i] = _shift_formula_rows(value, ws is self, self.title, end_index, start_index - end_index - 1)
+
+    def clear(self):
+        with self.spreadsheet.lock:
+            self._rows = []
+            self.spreadsheet._touch()
+
+    def append_rows(self, values, value_input_option=None, table_range=None, **kwargs):
+        parse = _parse_user_entered if value_input_option == "USER_ENTERED" else _parse_raw
+        with self.spreadsheet.lock:
+            updated = self._write_block(f"A{self._last_row() + 1}", values, parse)
+            self.spreadsheet._touch()
+        return {"updates": {"updatedRange": updated}}
+
+    def append_row(self, values, value_input_option=None, table_range=None, **kwargs):
+        return self.append_rows([values], value_input_option=value_input_option, table_range=table_range)
+
+
+class LocalSpreadsheet:
+    def __init__(self, title, path=None):
+        self.title = title
+        self.path = path
+        self.lock = threading.RLock()
+        self._sheets = []
+        self._revision = 0
+        self._updated_at = datetime.datetime.now(datetime.timezone.utc)
+        if path and os.path.exists(path):
+            self._load()
+        if not self._sheets:
+            self._sheets.append(LocalWorksheet(self, "Sheet1", sheet_id=0))
+
+    @property
+    def sheet1(self):
+        return self._sheets[0]
+
+    def worksheets(self):
+        return list(self._sheets)
+
+    def worksheet(self, title):
+        for ws in self._sheets:
+            if ws.title == title:
+                return ws
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows, cols, **kwargs):
+        with self.lock:
+            ws = LocalWorksheet(self, title, rows=rows, cols=cols, sheet_id=len(self._sheets))
+            self._sheets.append(ws)
+            self._touch()
+            return ws
+
+    def batch_update(self, body):
+        with self.lock:
+            for request in body.get("requests", []):
+                grid = request["deleteDimension"]["range"]
+                if grid["dimension"] != "ROWS":
+                    raise NotImplementedError(grid["dimension"])
+                ws = next(ws for ws in self._sheets if ws.id == grid["sheetId"])
+                ws._delete_rows(grid["startIndex"] + 1, grid["endIndex"])
+            self._touch()
+        return {"replies": [{} for _ in body.get("requests", [])]}
+
+    def get_lastUpdateTime(self):
+        return f"{self._updated_at.isoformat()}#{self._revision}"
+
+    def _touch(self):
+        self._revision += 1
+        self._updated_at = datetime.datetime.now(datetime.timezone.utc)
+        if self.path:
+            self._save()
+
+    # --- JSON-файл: формулы и проценты кодируются объектами ---
+    def _save(self):
+        def encode(value):
+            if isinstance(value, _Formula):
+                return {"f": str(value)}
+            if isinstance(value, _Percent):
+                return {"p": float(value)}
+            return value
+
+        payload = {
+            "title": self.title,
+            "sheets": [
+                {"title": ws.title, "rows": ws.row_count, "cols": ws.col_count,
+                 "cells": [[encode(v) for v in row] for row in ws._rows]}
+                for ws in self._sheets
+            ],
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        def decode(value):
+            if isinstance(value, dict):
+                return _Formula(value["f"]) if "f" in value else _Percent(value["p"])
+            return value
+
+        with open(self.path, encoding="utf-8") as f:
+            payload = json.load(f)
+        for i, item in enumerate(payload.get("sheets", [])):
+            ws = LocalWorksheet(self, item["title"], rows=item["rows"], cols=item["cols"], sheet_id=i)
+            ws._rows = [[decode(v) for v in row] for row in item["cells"]]
+            self._sheets.append(ws)
+
+
+# Ссылка на ячейку или диапазон в формуле (строки в кавычках пропускаются): лист, ячейки
+_ROW_REF_RE = re.compile(r"""("(?:[^"]|"")*")|(?<![\w$.])((?:'[^']+'|[A-Za-z_]\w*)!)?(\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?)(?![\w(])""")
+_CELL_ROW_RE = re.compile(r"(\$?[A-Z]{1,3}\$?)(\d+)")
+
+
+def _shift_formula_rows(formula, same_sheet, title, after_row, delta):
+    def shift_cell(m):
+        row = int(m.group(2))
+        return f"{m.group(1)}{row + delta if row > after_row else row}"
+
+    def shift(m):
+        if m.group(1):
+            return m.group(1)
+        sheet = m.group(2)[:-1].strip("'") if m.group(2) else None
+        if sheet == title if sheet else same_sheet:
+            return (m.group(2) or "") + _CELL_ROW_RE.sub(shift_cell, m.group(3))
+        return m.group(0)
+    return _Formula(_ROW_REF_RE.sub(shift, formula))
+
+
+# --- ВЫЧИСЛЕНИЕ ФОРМУЛ ---
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<string>"(?:[^"]|"")*")
+    | (?P<ref>(?:(?:'[^']+'|[A-Za-z_]\w*)!)?\$?[A-Z]{1,3}\$?\d*(?::\$?[A-Z]{1,3}\$?\d*)?(?![\w(]))
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<name>[A-Z][A-Z0-9.]*)(?=\s*\()
+    | (?P<bool>TRUE|FALSE)\b
+    | (?P<op>[-+*/();,])
+    )""", re.VERBOSE)
+
+_TOKEN_CACHE = {}
+
+
+def _tokenize(text):
+    tokens = _TOKEN_CACHE.get(text)
+    if tokens is not None:
+        return tokens
+    tokens = []
+    pos = 0
+    body = text.rstrip()
+    while pos < len(body):
+        m = _TOKEN_RE.match(body, pos)
+        if not m or m.end() == pos:
+            raise FormulaError(f"Не удалось разобрать формулу: {text}")
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    _TOKEN_CACHE[text] = tokens
+    return tokens
+
+
+_EVAL_ERRORS = (FormulaError, ZeroDivisionError, TypeError, ValueError)
+
+
+class _Range:
+    def __init__(self, worksheet, a1):
+        self.worksheet = worksheet
+        self.r1, self.c1, self.r2, self.c2 = parse_range(a1)
+
+    def cells(self):
+        r2 = self.worksheet._last_row() if self.r2 is None else self.r2
+        c2 = self.c2 or self.c1
+        for r in range(self.r1, r2 + 1):
+            for c in range(self.c1, c2 + 1):
+                yield r, c
+
+
+class _Cell:
+    __slots__ = ("worksheet", "row", "col")
+
+    def __init__(self, worksheet, row, col):
+        self.worksheet = worksheet
+        self.row = row
+        self.col = col
+
+
+# Значения формул кэшируются на одно чтение (один вызов get_*), цикл даёт #REF!
+class _Evaluator:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        self._memo = {}
+
+    def value(self, worksheet, row, col):
+        raw = worksheet._raw(row, col)
+        if not isinstance(raw, _Formula):
+            return raw
+        key = (worksheet.title, row, col)
+        if key not in self._memo:
+            self._memo[key] = "#REF!"
+            try:
+                self._memo[key] = _FormulaParser(self, worksheet, _tokenize(raw[1:])).evaluate()
+            except ZeroDivisionError:
+                self._memo[key] = "#DIV/0!"
+            except _EVAL_ERRORS:
+                self._memo[key] = "#ERROR!"
+        return self._memo[key]
+
+
+# Рекурсивный спуск: expr -> term (+|-) ..., term -> unary (*|/) ..., unary -> [-] atom
+class _FormulaParser:
+    def __init__(self, evaluator, worksheet, tokens):
+        self.evaluator = evaluator
+        self.worksheet = worksheet
+        self.tokens = tokens
+        self.pos = 0
+
+    def evaluate(self):
+        result = self._expr()
+        if self.pos != len(self.tokens):
+            raise FormulaError("лишние символы в формуле")
+        return self._scalar(result)
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _take(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _expect(self, op):
+        if self._take() != ("op", op):
+            raise FormulaError(f"ожидался '{op}'")
+
+    def _expr(self):
+        left = self._term()
+        while self._peek() in (("op", "+"), ("op", "-")):
+            op = self._take()[1]
+            right = self._term()
+            left = self._num(left) + self._num(right) if op == "+" else self._num(left) - self._num(right)
+        return left
+
+    def _term(self):
+        left = self._unary()
+        while self._peek() in (("op", "*"), ("op", "/")):
+            op = self._take()[1]
+            right = self._unary()
+            left = self._num(left) * self._num(right) if op == "*" else self._num(left) / self._num(right)
+        return left
+
+    def _unary(self):
+        if self._peek() == ("op", "-"):
+            self._take()
+            return -self._num(self._unary())
+        return self._atom()
+
+    def _atom(self):
+        kind, text = self._take()
+        if kind == "number":
+            return float(text)
+        if kind == "string":
+            return text[1:-1].replace('""', '"')
+        if kind == "bool":
+            return text == "TRUE"
+        if kind == "op" and text == "(":
+            value = self._expr()
+            self._expect(")")
+            return value
+        if kind == "ref":
+            return self._ref(text)
+        if kind == "name":
+            return self._call(text)
+        raise FormulaError(f"неожиданный токен {text}")
+
+    def _ref(self, text):
+        sheet_name, _, a1 = text.rpartition("!")
+        worksheet = self.evaluator.spreadsheet.worksheet(sheet_name.strip("'")) if sheet_name else self.worksheet
+        a1 = a1.replace("$", "")
+        if ":" in a1:
+            return _Range(worksheet, a1)
+        row, col, _, _ = parse_range(a1)
+        return _Cell(worksheet, row, col)
+
+    def _call(self, name):
+        self._expect("(")
+        args = []
+        if self._peek() != ("op", ")"):
+            while True:
+                start = self.pos
+                try:
+                    args.append(("ok", self._expr()))
+                except _EVAL_ERRORS as e:
+                    # Ошибку аргумента откладываем до IFERROR, остаток аргумента пропускаем
+                    self.pos = start
+                    self._skip_arg()
+                    args.append(("err", e))
+                if self._peek() in (("op", ";"), ("op", ",")):
+                    self._take()
+                    continue
+                break
+        self._expect(")")
+
+        if name == "IFERROR":
+            status, value = args[0]
+            value = self._scalar(value) if status == "ok" else None
+            if status == "err" or (isinstance(value, str) and value.startswith("#")):
+                return self._scalar(args[1][1]) if len(args) > 1 and args[1][0] == "ok" else ""
+            return value
+        values = []
+        for status, value in args:
+            if status == "err":
+                raise value
+            values.append(value)
+        if name == "ROUND":
+            return self._round(self._num(values[0]), int(self._num(values[1])) if len(values) > 1 else 0)
+        if name == "SUMIFS":
+            return self._sumifs(values)
+        raise FormulaError(f"функция {name} не поддерживается")
+
+    def _skip_arg(self):
+        depth = 0
+        while self.pos < len(self.tokens):
+            token = self._peek()
+            if token == ("op", "("):
+                depth += 1
+            elif token == ("op", ")"):
+                if depth == 0:
+                    return
+                depth -= 1
+            elif token in (("op", ";"), ("op", ",")) and depth == 0:
+                return
+            self._take()
+
+    @staticmethod
+    def _round(number, digits):
+        # Как в Sheets: половина округляется от нуля
+        sign = 1 if number >= 0 else -1
+        if digits >= 0:
+            factor = 10 ** digits
+            return sign * int(abs(number) * factor + 0.5) / factor
+        factor = 10 ** (-digits)
+        return sign * int(abs(number) / factor + 0.5) * factor
+
+    def _sumifs(self, values):
+        sum_range = values[0]
+        pairs = [(values[i], self._scalar(values[i + 1])) for i in range(1, len(values) - 1, 2)]
+        total = 0.0
+        for row, col in sum_range.cells():
+            matched = True
+            for crit_range, criterion in pairs:
+                r = crit_range.r1 + (row - sum_range.r1)
+                c = crit_range.c1 + (col - sum_range.c1)
+                if not self._matches(self.evaluator.value(crit_range.worksheet, r, c), criterion):
+                    matched = False
+                    break
+            if matched:
+                cell = self.evaluator.value(sum_range.worksheet, row, col)
+                if isinstance(cell, (int, float)) and not isinstance(cell, bool):
+                    total += cell
+        return total
+
+    @staticmethod
+    def _matches(cell, criterion):
+        if isinstance(criterion, bool):
+            return cell is criterion
+        if isinstance(criterion, (int, float)):
+            return isinstance(cell, (int, float)) and not isinstance(cell, bool) and cell == criterion
+        if criterion is None or criterion == "":
+            return cell is None or cell == ""
+        return isinstance(cell, str) and cell.lower() == str(criterion).lower()
+
+    def _scalar(self, value):
+        if isinstance(value, _Cell):
+            return self.evaluator.value(value.worksheet, value.row, value.col)
+        if isinstance(value, _Range):
+            raise FormulaError("#VALUE!")
+        return value
+
+    def _num(self, value):
+        value = self._scalar(value)
+        if value is None or value == "":
+            return 0.0
+        if isinstance(value, bool):
+            return 1.0 if value else 0.0
+        if isinstance(value, (int, float)):
+            return float(value)
+        raise FormulaError("#VALUE!")
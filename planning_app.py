@@ -3,7 +3,25 @@ import pandas as pd
 import plotly.graph_objects as go
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+from local_backend import LocalSpreadsheet
+import dependency_graph
+import scheduler
+import collections
+import contextlib
 import datetime
+import functools
+import hashlib
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
 
 # 1. Настройка страницы
 st.set_page_config(page_title="Quarterly Planning", layout="wide")
@@ -13,40 +31,377 @@ DEPARTMENTS = ["Data Platform", "BI", "ML", "DA", "DE", "Data Ops", "WAS"]
 CLIENTS = ["Data Department", "Partners", "Global Admin Panel", "Betting", "Casino", "Finance Core"]
 PRIORITIES = ["P0 (Critical)", "P1 (High)", "P2 (Medium)", "P3 (Low)"]
 SP_OPTIONS = [1, 2, 3, 5, 8]
+TASK_TYPES = ['Own Task', 'Incoming Blocker', 'Incoming Enabler']
+
+SPREADSHEET_NAME = "Quarterly Planning Data"
+SHEETS_SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+MAIN_SHEET_KEY = "__main__"
+STORAGE_BACKEND = os.environ.get("PLANNING_STORAGE_BACKEND", "google")
+LOCAL_STORE_PATH = os.environ.get("PLANNING_LOCAL_STORE", "planning_local.json")
+ANALYTICS_MODE = os.environ.get("PLANNING_ANALYTICS_MODE", "static")  # "static" | "live"
+MIRROR_DB_PATH = os.environ.get("PLANNING_MIRROR_DB", "planning_mirror.sqlite")
+MIRROR_SYNC_SECONDS = 30  # период фоновой сверки зеркала с таблицей
+MIRROR_FULL_SYNC_SECONDS = 600  # полная сверка, даже если ревизия с тех пор менялась только нашими записями
+SYNC_COALESCE_SECONDS = 3  # окно схлопывания фоновых синхронизаций
+SYNC_STATUS_REFRESH_SECONDS = 3
+
+# Квоты Sheets API на пользователя (сервисный аккаунт) в минуту; локальное хранилище не ограничивается.
+# Опрос очереди Write_Lock считается отдельно из своей доли чтений: ожидание блокировки
+# не должно съедать бюджет, нужный её держателю для чтения хвоста
+SHEETS_BUDGET_PER_MINUTE = {'read': 48, 'lock': 12, 'write': 60}
+API_MAX_RETRIES = 5
+API_RETRY_BASE_SECONDS = 1.0
+API_RETRY_MAX_SECONDS = 32.0
+
+TRACE_HISTORY = 30  # сколько последних трасс (прогонов и фоновых задач) держать для админ-панели
+ADMIN_PANEL = os.environ.get("PLANNING_ADMIN_PANEL", "") == "1"  # или ?admin=1 в адресе
+LOG_LEVEL = os.environ.get("PLANNING_LOG_LEVEL", "INFO")
+
+LOCK_SHEET = "Write_Lock"
+LOCK_LEASE_SECONDS = 30  # билет, не продлённый дольше этого, считается брошенным
+LOCK_RENEW_SECONDS = 10
+LOCK_WAIT_SECONDS = 45  # не меньше аренды: один брошенный билет не должен ронять всех за ним
+LOCK_TRIM_ROWS = 200  # после стольких строк держатель блокировки срезает закрытые билеты сверху
+LOCK_CLOCK_SKEW_SECONDS = 5  # запас на расхождение часов между процессами при сравнении времени билетов
+LOCK_RETRY_BASE_SECONDS = 0.2
+LOCK_RETRY_MAX_SECONDS = 5.0  # 12 опросов в минуту — вся доля 'lock'
+
+EXPECTED_COLS = ['Берем', 'Название задачи', 'Описание', 'Кто создал задачу', 'Исполнитель', 'Заказчик', 'Приоритет', 'RICE', 'Оценка (SP)', 'Reach', 'Impact', 'Confidence', 'Тип', 'Start date', 'End date', 'ID', 'Автодаты']
+# Автодаты — "старт/конец", которые последними поставил планировщик. Пока Start/End совпадают с ними,
+# даты задачи принадлежат плану и двигаются вместе с ним; правка дат руками делает их фиксированными.
+
+DEPENDENCY_SHEET = "Dependencies"
+DEPENDENCY_COLS = ['Blocker ID', 'Task ID', 'Type', 'Created']
+
+# --- ТРАССИРОВКА ---
+# Трасса — один прогон скрипта или одна фоновая задача: вложенные этапы (trace_stage / @traced)
+# и каждый вызов Sheets API (метод, задержка, объём). Текущая трасса хранится в thread-local,
+# завершённые пишутся в лог одной JSON-строкой и в кольцевой буфер для админ-панели.
+logger = logging.getLogger("planning_app")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+# Состояние общее для всех перезапусков скрипта: закэшированные прокси листов и фоновые потоки
+# держат функции из первого прогона, и они должны писать в те же thread-local и буфер
+@st.cache_resource(show_spinner=False)
+def _trace_history():
+    return {'lock': threading.Lock(), 'traces': collections.deque(maxlen=TRACE_HISTORY), 'local': threading.local()}
+
+_trace_local = _trace_history()['local']
+
+def start_trace(name):
+    trace = {
+        'name': name, 'started': datetime.datetime.now(), 't0': time.perf_counter(), 'last': time.perf_counter(),
+        'duration_ms': None, 'interrupted': False, 'stages': [], 'api': [],
+    }
+    _trace_local.trace = trace
+    _trace_local.stage = None
+    history = _trace_history()
+    with history['lock']:
+        history['traces'].append(trace)
+    return trace
+
+def current_trace():
+    return getattr(_trace_local, 'trace', None)
+
+# interrupted: прогон оборвали st.rerun()/st.stop() — длительность считается до последнего события.
+# Трассы без этапов и вызовов API (и отброшенные через keep=False) не логируются и не хранятся.
+def finish_trace(trace, interrupted=False, keep=True):
+    if trace is None or trace['duration_ms'] is not None:
+        return
+    end = trace['last'] if interrupted else time.perf_counter()
+    trace['duration_ms'] = (end - trace['t0']) * 1000
+    trace['interrupted'] = interrupted
+    if current_trace() is trace:
+        _trace_local.trace = None
+    if keep and (trace['stages'] or trace['api']):
+        logger.info(json.dumps(trace_summary(trace), ensure_ascii=False))
+        return
+    history = _trace_history()
+    with history['lock']:
+        if trace in history['traces']:
+            history['traces'].remove(trace)
+
+def trace_duration_ms(trace):
+    if trace['duration_ms'] is not None:
+        return trace['duration_ms']
+    return (time.perf_counter() - trace['t0']) * 1000
+
+def trace_summary(trace):
+    api = trace_api_breakdown(trace)
+    return {
+        'event': 'trace', 'trace': trace['name'], 'started': trace['started'].isoformat(timespec='seconds'),
+        'duration_ms': round(trace_duration_ms(trace), 1), 'interrupted': trace['interrupted'],
+        'stages': [{k: (round(v, 1) if k == 'ms' else v) for k, v in stage.items()} for stage in trace['stages']],
+        'api': api.to_dict('records'),
+    }
+
+@contextlib.contextmanager
+def trace_stage(name):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    parent = _trace_local.stage
+    _trace_local.stage = name
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        trace['stages'].append({'stage': name, 'parent': parent, 'ms': (now - t0) * 1000})
+        trace['last'] = now
+        _trace_local.stage = parent
+        logger.debug(json.dumps({'event': 'stage', 'trace': trace['name'], 'stage': name, 'ms': round((now - t0) * 1000, 1)}))
+
+def traced(stage):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace_stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# Объём — число символов в значениях запроса/ответа (для ячеек Sheets ≈ байтам полезной нагрузки)
+def payload_size(value):
+    if value is None:
+        return 0
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], list):
+            return sum(sum(len(str(v)) for v in row) for row in value)
+        return sum(payload_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(payload_size(v) for v in value.values())
+    return len(str(value))
+
+def record_api_call(method, kind, elapsed, sent, received, status="ok"):
+    trace = current_trace()
+    event = {'method': method, 'kind': kind, 'stage': getattr(_trace_local, 'stage', None),
+             'ms': elapsed * 1000, 'sent': sent, 'received': received, 'status': status}
+    if trace is not None:
+        trace['api'].append(event)
+        trace['last'] = time.perf_counter()
+    logger.debug(json.dumps(dict(event, event='api', ms=round(event['ms'], 1)), ensure_ascii=False))
+
+def trace_api_breakdown(trace):
+    columns = ['method', 'calls', 'ms', 'sent', 'received', 'errors']
+    if not trace['api']:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame(trace['api'])
+    df['errors'] = df['status'] != "ok"
+    out = df.groupby('method', as_index=False).agg(
+        calls=('ms', 'size'), ms=('ms', 'sum'), sent=('sent', 'sum'), received=('received', 'sum'), errors=('errors', 'sum'))
+    out['ms'] = out['ms'].round(1)
+    return out.sort_values('ms', ascending=False)[columns]
+
+def get_recent_traces():
+    history = _trace_history()
+    with history['lock']:
+        return list(history['traces'])
+
+# --- 2. ПОДКЛЮЧЕНИЕ К ХРАНИЛИЩУ (GOOGLE SHEETS / ЛОКАЛЬНОЕ) ---
+# Клиент, таблица и листы живут в st.cache_resource: один авторизованный сеанс
+# на процесс (токен gspread обновляет сам), без повторного OAuth и client.open на каждый вызов.
+@st.cache_resource(show_spinner=False)
+@traced("auth")
+def _authorize_client():
+    creds_dict = dict(st.secrets["gcp_service_account"])
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SHEETS_SCOPE)
+    return gspread.authorize(creds)
 
-# --- 2. ПОДКЛЮЧЕНИЕ К GOOGLE SHEETS ---
 def get_client():
     try:
         if "gcp_service_account" not in st.secrets:
             st.error("❌ Не найден раздел [gcp_service_account] в Secrets.")
             st.stop()
             
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        return client
+        return _authorize_client()
     except Exception as e:
         st.error(f"❌ Ошибка подключения: {e}")
         st.stop()
 
+# Все вызовы Sheets API идут через sheets_call: скользящее окно в минуту отдельно для чтений
+# и записей (при исчерпании вызов ждёт в очереди), повтор с экспоненциальной паузой и jitter
+# на 429 и 5xx. append не идемпотентен — его повторяем только на 429, когда запрос точно не применён.
+SHEETS_API_CALLS = {
+    'get_all_values': 'read', 'get_values': 'read', 'col_values': 'read', 'get_lastUpdateTime': 'read',
+    'open': 'read', 'worksheet': 'read', 'worksheets': 'read', 'sheet1': 'read',
+    'update': 'write', 'update_cell': 'write', 'batch_update': 'write', 'batch_clear': 'write',
+    'clear': 'write', 'add_rows': 'write', 'add_worksheet': 'write', 'delete_rows': 'write',
+    'append_row': 'append', 'append_rows': 'append',
+}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class SheetsQuotaError(TimeoutError):
+    pass
+
+@st.cache_resource(show_spinner=False)
+def _api_limiter():
+    return {
+        'lock': threading.Lock(),
+        'calls': {bucket: collections.deque() for bucket in SHEETS_BUDGET_PER_MINUTE},
+        'stats': {'issued': 0, 'throttled': 0, 'retried': 0, 'failed': 0},
+    }
+
+def _acquire_api_budget(bucket):
+    limiter = _api_limiter()
+    limit = None if STORAGE_BACKEND == "local" else SHEETS_BUDGET_PER_MINUTE[bucket]
+    throttled = False
+    while True:
+        with limiter['lock']:
+            now = time.monotonic()
+            calls = limiter['calls'][bucket]
+            while calls and now - calls[0] >= 60:
+                calls.popleft()
+            if limit is None or len(calls) < limit:
+                calls.append(now)
+                limiter['stats']['issued'] += 1
+                return
+            wait = calls[0] + 60 - now
+            if not throttled:
+                limiter['stats']['throttled'] += 1
+                throttled = True
+        time.sleep(wait)
+
+def sheets_call(kind, fn, *args, **kwargs):
+    attempt = 0
+    while True:
+        _acquire_api_budget(kind if kind in ('read', 'lock') else 'write')
+        t0 = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            record_api_call(fn.__name__, kind, time.perf_counter() - t0,
+                            payload_size(args) + payload_size(kwargs.get('values')), payload_size(result) if kind in ('read', 'lock') else 0)
+            return result
+        except gspread.exceptions.APIError as e:
+            status = e.response.status_code
+            record_api_call(fn.__name__, kind, time.perf_counter() - t0, payload_size(args), 0, status=str(status))
+            if status not in RETRYABLE_STATUS or (kind == 'append' and status != 429):
+                raise
+            limiter = _api_limiter()
+            with limiter['lock']:
+                if attempt >= API_MAX_RETRIES:
+                    limiter['stats']['failed'] += 1
+                    raise SheetsQuotaError(f"Google Sheets перегружен или исчерпана квота (HTTP {status}), попробуйте через минуту.") from e
+                limiter['stats']['retried'] += 1
+            delay = min(API_RETRY_BASE_SECONDS * 2 ** attempt, API_RETRY_MAX_SECONDS)
+            time.sleep(delay + random.uniform(0, delay))
+            attempt += 1
+
+def get_api_stats():
+    limiter = _api_limiter()
+    with limiter['lock']:
+        return dict(limiter['stats'])
+
+# Обёртка таблицы/листа: методы из SHEETS_API_CALLS уходят через sheets_call, остальное — как есть
+class SheetsApiProxy:
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        kind = SHEETS_API_CALLS.get(name)
+        if kind is None:
+            return getattr(self._target, name)
+        if name == 'sheet1':
+            def sheet1():
+                return self._target.sheet1
+            return SheetsApiProxy(sheets_call(kind, sheet1))
+        method = getattr(self._target, name)
+        
+        def call(*args, **kwargs):
+            result = sheets_call(kind, method, *args, **kwargs)
+            return SheetsApiProxy(result) if name in ('open', 'worksheet', 'add_worksheet') else result
+        return call
+
+# Хранилище выбирается переменной окружения: "google" (по умолчанию) или "local" —
+# локальная замена из local_backend.py с тем же API, для прогонов без GCP и сети.
+@st.cache_resource(show_spinner=False)
+def get_spreadsheet():
+    if STORAGE_BACKEND == "local":
+        return SheetsApiProxy(LocalSpreadsheet(SPREADSHEET_NAME, path=LOCAL_STORE_PATH or None))
+    return SheetsApiProxy(get_client()).open(SPREADSHEET_NAME)
+
+@st.cache_resource(show_spinner=False)
+def _worksheet_registry():
+    return {'lock': threading.Lock(), 'sheets': {}}
+
+def _open_worksheet(key, rows, cols):
+    sh = get_spreadsheet()
+    if key == MAIN_SHEET_KEY:
+        return sh.sheet1
+    try:
+        return sh.worksheet(key)
+    except gspread.exceptions.WorksheetNotFound:
+        return sh.add_worksheet(title=key, rows=rows, cols=cols)
+
+# Лист удалили (или удалили и создали заново) руками: gspread отвечает WorksheetNotFound
+# или 400 на диапазон/sheetId, которых больше нет
+MISSING_SHEET_MARKERS = ("Unable to parse range", "No grid with id", "Requested entity was not found")
+
+def is_missing_sheet_error(error):
+    if isinstance(error, gspread.exceptions.WorksheetNotFound):
+        return True
+    return (isinstance(error, gspread.exceptions.APIError) and error.response.status_code in (400, 404)
+            and any(marker in str(error) for marker in MISSING_SHEET_MARKERS))
+
+# Лист по имени. Хэндл кэшируется в реестре, но если вызов API упал из-за пропавшего листа,
+# хэндл сбрасывается, лист открывается (или создаётся) заново и вызов повторяется один раз —
+# как было, когда лист искался на каждый вызов
+class WorksheetRef:
+    def __init__(self, key, rows, cols):
+        self._key, self._rows, self._cols = key, rows, cols
+
+    def _handle(self, reopen=False):
+        registry = _worksheet_registry()
+        with registry['lock']:
+            if reopen:
+                registry['sheets'].pop(self._key, None)
+            ws = registry['sheets'].get(self._key)
+            if ws is None:
+                ws = _open_worksheet(self._key, self._rows, self._cols)
+                registry['sheets'][self._key] = ws
+            return ws
+
+    def __getattr__(self, name):
+        attr = getattr(self._handle(), name)
+        if name not in SHEETS_API_CALLS:
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except (gspread.exceptions.WorksheetNotFound, gspread.exceptions.APIError) as e:
+                if not is_missing_sheet_error(e):
+                    raise
+                logger.warning(json.dumps({'event': 'worksheet_reopen', 'sheet': self._key, 'error': str(e)}, ensure_ascii=False))
+                return getattr(self._handle(reopen=True), name)(*args, **kwargs)
+        return call
+
+def get_worksheet(title, rows=1000, cols=20):
+    return WorksheetRef(title, rows, cols)
+
 def get_main_sheet():
-    client = get_client()
-    return client.open("Quarterly Planning Data").sheet1
+    return WorksheetRef(MAIN_SHEET_KEY, 1000, len(EXPECTED_COLS))
+
+def reset_connection():
+    # Сброс кэша подключения (например, если лист удалили или переименовали вручную).
+    # Локальная таблица без файла живёт только в этом объекте — её не пересоздаём
+    _worksheet_registry.clear()
+    if STORAGE_BACKEND != "local" or LOCAL_STORE_PATH:
+        get_spreadsheet.clear()
 
 # --- 3. РАБОТА С НАСТРОЙКАМИ CAPACITY ---
-def load_capacity_settings(client, departments_list):
-    sh = client.open("Quarterly Planning Data")
-    
-    try:
-        ws = sh.worksheet("Capacity_Settings")
-    except:
-        ws = sh.add_worksheet(title="Capacity_Settings", rows=50, cols=4)
-        
+@traced("load_capacity")
+def load_capacity_settings(departments_list):
+    ws = get_worksheet("Capacity_Settings", rows=50, cols=4)
     raw_data = ws.get_all_values()
     expected_cols = ["Team", "People", "Days", "Threshold"]
-    
+
     if not raw_data or raw_data[0] != expected_cols:
         ws.clear()
         default_rows = [expected_cols]
@@ -75,10 +430,10 @@ def load_capacity_settings(client, departments_list):
             
     return settings
 
-def save_capacity_settings(client, settings_dict):
-    sh = client.open("Quarterly Planning Data")
-    ws = sh.worksheet("Capacity_Settings")
-    
+@traced("save_capacity")
+def save_capacity_settings(settings_dict):
+    ws = get_worksheet("Capacity_Settings", rows=50, cols=4)
+
     rows = [["Team", "People", "Days", "Threshold"]]
     for team, vals in settings_dict.items():
         rows.append([team, vals['people'], vals['days'], vals['overhead']])
@@ -97,432 +452,2116 @@ def make_text_bar(val, max_val):
     return f"{filled} {val}/{max_val}"
 
 # --- 4. JIRA SYNC ---
-def sync_jira_sheet(client, df_source):
-    if df_source.empty:
-        return
+# Вкладка csv обновляется по диффу: у каждой строки есть ключ задачи и хэш содержимого
+# (последние две колонки), так что пишутся только добавленные/изменённые строки,
+# а удалённые закрываются перестановкой хвоста. Вкладка никогда не бывает пустой посреди синка.
+JIRA_COLUMNS = ['Summary', 'Description', 'Priority', 'Story Points', 'Issue Type', 'Labels', 'Component']
+JIRA_SYNC_COLUMNS = ['Planning Key', 'Row Hash']
 
-    sh = client.open("Quarterly Planning Data")
-    try:
-        ws_csv = sh.worksheet("csv")
-    except:
-        ws_csv = sh.add_worksheet(title="csv", rows=1000, cols=20)
+def task_row_key(sheet_row):
+    return f"ROW-{sheet_row}"
+
+def row_hash(values):
+    normalized = [str(float(v)) if isinstance(v, (int, float)) else str(v) for v in values]
+    return hashlib.md5("\x1f".join(normalized).encode("utf-8")).hexdigest()[:12]
+
+def col_letter(col_num):
+    letters = ""
+    while col_num > 0:
+        col_num, rem = divmod(col_num - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def as_text(values):
+    return values.astype(object).where(values.notna(), '').astype(str)
+
+def format_task_date(values):
+    return values.dt.strftime('%Y-%m-%d').fillna('')
+
+def format_rice(values):
+    return values.map(lambda v: "" if pd.isna(v) else (str(int(v)) if float(v).is_integer() else f"{v:g}"))
+
+def build_jira_rows(df_source):
+    df_active = df_source[df_source['Берем']]
 
-    df_active = df_source[df_source['Берем'].astype(str).str.upper() == 'TRUE'].copy()
-    
     if df_active.empty:
-        ws_csv.clear()
-        return
+        return []
 
-    df_jira = pd.DataFrame()
+    df_jira = pd.DataFrame(index=df_active.index)
     df_jira['Summary'] = df_active['Название задачи']
-    
+
     df_jira['Description'] = df_active['Описание'] + "\n\n" + \
                              "--- Planning Info ---\n" + \
                              "Author: " + df_active['Кто создал задачу'] + "\n" + \
-                             "RICE Score: " + df_active['RICE'].astype(str) + "\n" + \
-                             "Start: " + df_active['Start date'].astype(str) + "\n" + \
-                             "End: " + df_active['End date'].astype(str) + "\n" + \
-                             "Type: " + df_active['Тип']
+                             "RICE Score: " + format_rice(df_active['RICE']) + "\n" + \
+                             "Start: " + format_task_date(df_active['Start date']) + "\n" + \
+                             "End: " + format_task_date(df_active['End date']) + "\n" + \
+                             "Type: " + as_text(df_active['Тип'])
 
     priority_map = {"P0 (Critical)": "Highest", "P1 (High)": "High", "P2 (Medium)": "Medium", "P3 (Low)": "Low"}
-    df_jira['Priority'] = df_active['Приоритет'].map(priority_map).fillna("Medium")
-    df_jira['Story Points'] = pd.to_numeric(df_active['Оценка (SP)'], errors='coerce').fillna(0)
+    df_jira['Priority'] = as_text(df_active['Приоритет']).map(priority_map).fillna("Medium")
+    df_jira['Story Points'] = df_active['Оценка (SP)'].fillna(0).astype(int)
     df_jira['Issue Type'] = "Story"
-    df_jira['Labels'] = df_active['Заказчик'].str.replace(" ", "_") + ", Q_Planning"
-    df_jira['Component'] = df_active['Исполнитель'] 
+    df_jira['Labels'] = as_text(df_active['Заказчик']).str.replace(" ", "_") + ", Q_Planning"
+    df_jira['Component'] = as_text(df_active['Исполнитель'])
+
+    # Ключ — стабильный ID задачи; у строк без ID — номер строки (строка данных i лежит в строке i + 2 листа)
+    rows = []
+    for idx, task_id, values in zip(df_jira.index, df_active['ID'], df_jira[JIRA_COLUMNS].values.tolist()):
+        rows.append((task_id.strip() or task_row_key(idx + 2), values))
+    return rows
+
+@traced("sync_jira")
+def sync_jira_sheet(df_source):
+    if df_source.empty:
+        return
+
+    ws_csv = get_worksheet("csv")
+    header = JIRA_COLUMNS + JIRA_SYNC_COLUMNS
+    key_col = col_letter(len(JIRA_COLUMNS) + 1)
+    last_col = col_letter(len(header))
+
+    desired = {}
+    for key, values in build_jira_rows(df_source):
+        desired[key] = values + [key, row_hash(values)]
 
-    ws_csv.clear()
-    ws_csv.update([df_jira.columns.values.tolist()] + df_jira.values.tolist())
+    # Читаем только колонки ключа и хэша, а не всю вкладку с описаниями
+    existing = ws_csv.get_values(f"{key_col}1:{last_col}")
+
+    if not existing or existing[0][:2] != JIRA_SYNC_COLUMNS:
+        # Старый формат вкладки или пустая вкладка: один раз переписываем целиком
+        ws_csv.clear()
+        ws_csv.update(range_name='A1', values=[header] + list(desired.values()))
+        return
+
+    placed = {}
+    free_rows = []
+    for i, row in enumerate(existing[1:], start=2):
+        key = row[0] if row else ""
+        if key in desired and key not in placed:
+            placed[key] = (i, row[1] if len(row) > 1 else "")
+        else:
+            free_rows.append(i)
+    last_used_row = len(existing)
+
+    writes = {}
+    for key, values in desired.items():
+        if key in placed:
+            sheet_row, old_hash = placed[key]
+            if old_hash != values[-1]:
+                writes[sheet_row] = values
+
+    added = [key for key in desired if key not in placed]
+    free_rows.sort()
+    next_row = last_used_row + 1
+    for key in added:
+        if free_rows:
+            sheet_row = free_rows.pop(0)
+        else:
+            sheet_row = next_row
+            next_row += 1
+        placed[key] = (sheet_row, "")
+        writes[sheet_row] = desired[key]
+
+    # Оставшиеся дыры закрываем строками из хвоста, хвост очищаем
+    final_last_row = len(desired) + 1
+    holes = [r for r in free_rows if r <= final_last_row]
+    tail_keys = sorted((r, k) for k, (r, _) in placed.items() if r > final_last_row)
+    for hole, (old_row, key) in zip(holes, tail_keys):
+        writes.pop(old_row, None)
+        writes[hole] = desired[key]
+
+    if writes:
+        ws_csv.batch_update([{'range': f"A{r}:{last_col}{r}", 'values': [v]} for r, v in sorted(writes.items())])
+    last_row = next_row - 1
+    if last_row > final_last_row:
+        ws_csv.batch_clear([f"A{final_last_row + 1}:{last_col}{last_row}"])
 
 # --- 5. ANALYTICS SYNC ---
-def update_analytics_tab(client, df_tasks, capacity_settings, clients_list):
-    sh = client.open("Quarterly Planning Data")
-    main_ws_name = sh.sheet1.title
-    
-    try:
-        ws_an = sh.worksheet("Analytics_Data")
-    except:
-        ws_an = sh.add_worksheet(title="Analytics_Data", rows=1000, cols=20)
-    
-    ws_an.clear()
-    
-    headers_1 = ["Исполнитель", "Real Capacity (с учетом Threshold)", "Занято (Live Formula)", "Остаток"]
-    rows_1 = []
-    current_row = 2
-    
+# Вся раскладка Analytics_Data собирается в памяти и уходит одним запросом
+# (плюс clear), вместо пары update на каждую команду.
+# По умолчанию "Занято" и разбивка по заказчикам считаются в приложении одним groupby
+# и пишутся значениями с отметкой времени: 49 SUMIFS по целым колонкам больше не
+# пересчитываются на каждую ручную правку листа. PLANNING_ANALYTICS_MODE=live возвращает формулы.
+def real_capacity(settings):
+    total_days = settings['people'] * settings['days']
+    overhead_percent = settings.get('overhead', 20)
+    return round(total_days * (100 - overhead_percent) / 100.0, 1)
+
+def capacity_key(capacity_settings):
+    return tuple((team, v['people'], v['days'], v.get('overhead', 20)) for team, v in capacity_settings.items())
+
+# workload — агрегат load_workload() (SP взятых задач по исполнителю/заказчику/типу)
+def compute_sp_usage(workload):
+    by_team = workload.groupby('Исполнитель')['Оценка (SP)'].sum()
+    by_team_client = workload.groupby(['Исполнитель', 'Заказчик'])['Оценка (SP)'].sum()
+    return by_team, by_team_client
+
+def build_analytics_grid(main_ws_name, capacity_settings, clients_list, workload=None):
+    live = workload is None
+    if live:
+        grid = [["Исполнитель", "Real Capacity (с учетом Threshold)", "Занято (Live Formula)", "Остаток"]]
+    else:
+        by_team, by_team_client = compute_sp_usage(workload)
+        computed_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        grid = [["Исполнитель", "Real Capacity (с учетом Threshold)", "Занято (SP)", "Остаток", "", "Рассчитано приложением", computed_at]]
+
     for team, settings in capacity_settings.items():
-        total_days = settings['people'] * settings['days']
-        overhead_percent = settings.get('overhead', 20)
-        cap_val = round(total_days * (100 - overhead_percent) / 100.0, 1)
-        
-        formula_used = f"=SUMIFS('{main_ws_name}'!I:I; '{main_ws_name}'!E:E; A{current_row}; '{main_ws_name}'!A:A; TRUE)"
-        formula_left = f"=B{current_row}-C{current_row}"
+        current_row = len(grid) + 1
+        cap_val = real_capacity(settings)
         
-        rows_1.append([team, cap_val, formula_used, formula_left])
-        current_row += 1
+        if live:
+            used = f"=SUMIFS('{main_ws_name}'!I:I; '{main_ws_name}'!E:E; A{current_row}; '{main_ws_name}'!A:A; TRUE)"
+            left = f"=B{current_row}-C{current_row}"
+        else:
+            used = round(float(by_team.get(team, 0)), 1)
+            left = round(cap_val - used, 1)
         
-    ws_an.update(range_name='A1', values=[headers_1])
-    ws_an.update(range_name='A2', values=rows_1, value_input_option='USER_ENTERED')
-    
-    start_row = len(rows_1) + 6
-    
+        grid.append([team, cap_val, used, left])
+
+    # Блоки распределения по заказчикам начинаются через 4 пустые строки
+    grid.extend([[""]] * 4)
+
     for team in capacity_settings.keys():
-        ws_an.update(range_name=f'A{start_row}', values=[[f"РАСПРЕДЕЛЕНИЕ: {team}"]])
-        start_row += 1
-        ws_an.update(range_name=f'A{start_row}', values=[["Заказчик", "SP (Checked Only)"]])
-        start_row += 1
+        grid.append([f"РАСПРЕДЕЛЕНИЕ: {team}"])
+        grid.append(["Заказчик", "SP (Checked Only)"])
         
-        team_rows = []
         for client_name in clients_list:
-            formula = f"=SUMIFS('{main_ws_name}'!I:I; '{main_ws_name}'!E:E; \"{team}\"; '{main_ws_name}'!F:F; A{start_row}; '{main_ws_name}'!A:A; TRUE)"
-            team_rows.append([client_name, formula])
-            start_row += 1
+            current_row = len(grid) + 1
+            if live:
+                used = f"=SUMIFS('{main_ws_name}'!I:I; '{main_ws_name}'!E:E; \"{team}\"; '{main_ws_name}'!F:F; A{current_row}; '{main_ws_name}'!A:A; TRUE)"
+            else:
+                used = round(float(by_team_client.get((team, client_name), 0)), 1)
+            grid.append([client_name, used])
             
-        write_range_start = start_row - len(clients_list)
-        ws_an.update(range_name=f'A{write_range_start}', values=team_rows, value_input_option='USER_ENTERED')
-        start_row += 2
+        grid.extend([[""]] * 2)
+
+    return grid
+
+@traced("update_analytics")
+def update_analytics_tab(capacity_settings, clients_list):
+    main_ws_name = get_main_sheet().title
+    ws_an = get_worksheet("Analytics_Data")
+
+    workload = None if ANALYTICS_MODE == "live" else load_workload(mirror_version())
+    grid = build_analytics_grid(main_ws_name, capacity_settings, clients_list, workload=workload)
+
+    ws_an.clear()
+    ws_an.update(range_name='A1', values=grid, value_input_option='USER_ENTERED')
 
 # --- 6. ЧТЕНИЕ ДАННЫХ ---
-def load_data():
+# Все чтения идут из локального зеркала SQLite (лист задач, Capacity_Settings, Dependencies). Зеркало
+# догоняет таблицу в фоне: сначала дешёвая проверка modifiedTime через Drive, и только если
+# таблица менялась — выгрузка и применение изменившихся строк по хэшу. Записи приложения
+# сразу попадают и в зеркало. Если Google недоступен, приложение работает на зеркале в режиме чтения.
+MIRROR_FIELDS = ['taken', 'name', 'description', 'author', 'executor', 'client', 'priority', 'rice',
+                 'sp', 'reach', 'impact', 'confidence', 'type', 'start_date', 'end_date', 'task_id', 'auto_dates']  # порядок EXPECTED_COLS
+
+MIRROR_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS tasks (
+    row_num INTEGER PRIMARY KEY,
+    {', '.join(f'{f} TEXT NOT NULL DEFAULT ""' for f in MIRROR_FIELDS)},
+    quarter TEXT,
+    row_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_p0 ON tasks (executor, priority, type);
+CREATE INDEX IF NOT EXISTS idx_tasks_name ON tasks (name);
+CREATE TABLE IF NOT EXISTS dependencies (
+    blocker_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    PRIMARY KEY (blocker_id, task_id)
+);
+CREATE TABLE IF NOT EXISTS capacity (
+    team TEXT PRIMARY KEY,
+    people INTEGER NOT NULL,
+    days INTEGER NOT NULL,
+    overhead INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Квартал задачи ("2026-Q3") по дате старта, а если старта нет или он не разбирается — по концу
+# (у зависимостей без старта это дедлайн). Форматы — как в parse_task_dates. Одно правило на всё
+# приложение: зеркало считает его один раз при записи строки и хранит в индексированной колонке quarter.
+def plan_quarter(start, end):
+    for value in (start, end):
+        for fmt in ('%Y-%m-%d', '%d.%m.%Y'):
+            try:
+                day = datetime.datetime.strptime(str(value).strip(), fmt)
+            except ValueError:
+                continue
+            return f"{day.year}-Q{(day.month + 2) // 3}"
+    return None
+
+def mirror_connect():
+    return sqlite3.connect(MIRROR_DB_PATH, timeout=10)
+
+MIRROR_INSERT_SQL = (f"INSERT OR REPLACE INTO tasks (row_num, {', '.join(MIRROR_FIELDS)}, quarter, row_hash) "
+                     f"VALUES ({', '.join(['?'] * (len(MIRROR_FIELDS) + 3))})")
+
+@st.cache_resource(show_spinner=False)
+def _mirror_state():
+    conn = mirror_connect()
+    with conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(MIRROR_SCHEMA)
+        # Зеркало прошлых версий: недостающие колонки добавляются, строки перепишет ближайшая сверка (хэш другой)
+        known = {info[1] for info in conn.execute("PRAGMA table_info(tasks)")}
+        for field in MIRROR_FIELDS:
+            if field not in known:
+                conn.execute(f'ALTER TABLE tasks ADD COLUMN {field} TEXT NOT NULL DEFAULT ""')
+        if 'quarter' not in known:
+            conn.execute("ALTER TABLE tasks ADD COLUMN quarter TEXT")
+            conn.executemany("UPDATE tasks SET quarter = ? WHERE row_num = ?", [
+                (plan_quarter(start, end), row_num)
+                for row_num, start, end in conn.execute("SELECT row_num, start_date, end_date FROM tasks").fetchall()
+            ])
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_id ON tasks (task_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_quarter ON tasks (quarter)")
+    conn.close()
+    return {
+        'sync_lock': threading.Lock(),
+        'worker_lock': threading.Lock(),
+        'thread': None,
+        'revision': None,
+        'full_synced_at': 0.0,
+        'last_synced': None,
+        'last_error': None,
+    }
+
+def _bump_mirror_version(conn):
+    conn.execute("INSERT INTO meta (key, value) VALUES ('version', '1') "
+                 "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+def mirror_version():
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
+
+def fetch_sheet_values():
     sheet = get_main_sheet()
     raw_data = sheet.get_all_values()
-    
-    expected_cols = ['Берем', 'Название задачи', 'Описание', 'Кто создал задачу', 'Исполнитель', 'Заказчик', 'Приоритет', 'RICE', 'Оценка (SP)', 'Reach', 'Impact', 'Confidence', 'Тип', 'Start date', 'End date']
-    
+
     if not raw_data:
-        sheet.append_row(expected_cols)
-        return pd.DataFrame(columns=expected_cols)
+        sheet.append_row(EXPECTED_COLS)
+        return [EXPECTED_COLS]
 
-    if raw_data[0] != expected_cols:
-        sheet.update(range_name='A1:O1', values=[expected_cols])
+    if raw_data[0] != EXPECTED_COLS:
+        sheet.update(range_name=f'A1:{col_letter(len(EXPECTED_COLS))}1', values=[EXPECTED_COLS])
         raw_data = sheet.get_all_values()
 
-    headers = raw_data[0]
-    data = raw_data[1:] if len(raw_data) > 1 else []
-    df = pd.DataFrame(data, columns=headers)
-    return df
+    return raw_data
 
-# --- 7. СОХРАНЕНИЕ ЗАДАЧ ---
-def save_rows(rows_list):
-    sheet = get_main_sheet()
-    all_values = sheet.get_all_values()
-    
-    last_filled_row = 0
-    for i, row in enumerate(all_values):
-        if len(row) > 1 and row[1].strip():
-            last_filled_row = i + 1
+# Значения в порядке MIRROR_INSERT_SQL без row_num: поля, квартал, хэш (последним — по нему сверка)
+def _mirror_row(row):
+    row = [str(v) for v in row[:len(EXPECTED_COLS)]]
+    row += [""] * (len(EXPECTED_COLS) - len(row))
+    return row + [plan_quarter(row[13], row[14]), row_hash(row)]
+
+def mirror_upsert_rows(start_row, rows):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn, conn:
+        conn.executemany(MIRROR_INSERT_SQL, [[start_row + i] + _mirror_row(row) for i, row in enumerate(rows)])
+        _bump_mirror_version(conn)
+
+def mirror_set_priority(row_num, priority):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn, conn:
+        conn.execute("UPDATE tasks SET priority = ?, row_hash = '' WHERE row_num = ?", (priority, row_num))
+        _bump_mirror_version(conn)
+
+# rows — [(строка, "старт/конец")]: автодаты, переписанные планом
+def mirror_set_dates(rows):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn, conn:
+        conn.executemany(
+            "UPDATE tasks SET start_date = ?, end_date = ?, auto_dates = ?, quarter = ?, row_hash = '' WHERE row_num = ?",
+            [(*dates.split("/"), dates, plan_quarter(*dates.split("/")), row_num) for row_num, dates in rows],
+        )
+        _bump_mirror_version(conn)
+
+def mirror_add_edges(edges):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn, conn:
+        conn.executemany("INSERT OR REPLACE INTO dependencies (blocker_id, task_id, kind) VALUES (?, ?, ?)", edges)
+        _bump_mirror_version(conn)
+
+def _mirror_replace_edges(conn, edges):
+    if set(conn.execute("SELECT blocker_id, task_id, kind FROM dependencies")) == set(edges):
+        return False
+    conn.execute("DELETE FROM dependencies")
+    conn.executemany("INSERT OR REPLACE INTO dependencies (blocker_id, task_id, kind) VALUES (?, ?, ?)", edges)
+    return True
+
+def mirror_save_capacity(settings_dict):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn, conn:
+        conn.execute("DELETE FROM capacity")
+        conn.executemany(
+            "INSERT INTO capacity (team, people, days, overhead) VALUES (?, ?, ?, ?)",
+            [(team, v['people'], v['days'], v['overhead']) for team, v in settings_dict.items()],
+        )
+
+@traced("sync_mirror")
+def sync_mirror(force=False):
+    state = _mirror_state()
+    with state['sync_lock']:
+        revision = get_spreadsheet().get_lastUpdateTime()
+        full_due = time.monotonic() - state['full_synced_at'] > MIRROR_FULL_SYNC_SECONDS
+        if not force and not full_due and revision == state['revision']:
+            return False
+        
+        rows = assign_missing_task_ids(fetch_sheet_values()[1:])
+        edges = load_dependency_sheet(rows)
+        with contextlib.closing(mirror_connect()) as conn, conn:
+            known = dict(conn.execute("SELECT row_num, row_hash FROM tasks"))
+            changed = []
+            for i, row in enumerate(rows, start=2):
+                mirrored = _mirror_row(row)
+                if known.get(i) != mirrored[-1]:
+                    changed.append([i] + mirrored)
+            removed = conn.execute("DELETE FROM tasks WHERE row_num > ?", (len(rows) + 1,)).rowcount
+            if changed:
+                conn.executemany(MIRROR_INSERT_SQL, changed)
+            edges_changed = _mirror_replace_edges(conn, edges)
+            if changed or removed or edges_changed:
+                _bump_mirror_version(conn)
             
-    target_row = last_filled_row + 1
-    
+        mirror_save_capacity(load_capacity_settings(DEPARTMENTS))
+        state['revision'] = revision
+        state['full_synced_at'] = time.monotonic()
+        state['last_synced'] = datetime.datetime.now()
+        state['last_error'] = None
+        return True
+
+def _mirror_sync_worker(state):
+    while True:
+        trace = start_trace("mirror_sync")
+        changed = True
+        try:
+            changed = sync_mirror()
+        except Exception as e:
+            state['last_error'] = str(e)
+        # Пустые сверки (таблица не менялась) идут каждые MIRROR_SYNC_SECONDS — их не храним
+        finish_trace(trace, keep=changed)
+        time.sleep(MIRROR_SYNC_SECONDS)
+
+def ensure_mirror_worker():
+    state = _mirror_state()
+    # Не sync_lock: его сверка держит всё время загрузки листа, и каждый rerun ждал бы её
+    with state['worker_lock']:
+        if state['thread'] is None or not state['thread'].is_alive():
+            state['thread'] = threading.Thread(target=_mirror_sync_worker, args=(state,), name="mirror-sync", daemon=True)
+            state['thread'].start()
+
+# Ревизия таблицы общая на все листы и меняется и от собственных записей приложения (задачи, связи,
+# Write_Lock, csv, Analytics_Data). Если зеркало эти записи уже применило, запоминаем новую ревизию,
+# чтобы фоновая сверка не скачивала лист заново. Ревизия сдвигается, только если:
+#   - до записи (и до билета блокировки) таблица была на ревизии зеркала — иначе в ней уже есть чужая правка;
+#   - в очереди Write_Lock с начала записи нет чужих билетов: другой писатель мог записать свои строки
+#     до нашей блокировки или сразу после неё (до контрольного чтения ревизии).
+# Ручную правку, попавшую ровно между этими чтениями, подберёт полная сверка раз в MIRROR_FULL_SYNC_SECONDS.
+# before — из mirror_revision_before_write(), ticket — билет блокировки, под которой шла запись.
+def mirror_revision_before_write():
+    state = _mirror_state()
+    if state['revision'] is None:
+        return None
+    return {'at': time.time(), 'revision': get_spreadsheet().get_lastUpdateTime()}
+
+def mirror_note_own_write(before, ticket=None):
+    state = _mirror_state()
+    if before is None or before['revision'] != state['revision']:
+        return
+    revision = get_spreadsheet().get_lastUpdateTime()
+    queue_rows = read_lock_queue_rows() + (ticket['queue'] if ticket else [])
+    own_token = ticket['token'] if ticket else None
+    since = int(before['at']) - LOCK_CLOCK_SKEW_SECONDS
+    if any(row[0] != own_token and int(row[1]) >= since for row in queue_rows if len(row) > 1 and row[1].isdigit()):
+        return
+    if state['revision'] == before['revision']:
+        state['revision'] = revision
+
+def get_mirror_status():
+    state = _mirror_state()
+    return {'last_synced': state['last_synced'], 'last_error': state['last_error']}
+
+def _mirror_is_empty():
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone() is None
+
+def ensure_mirror_loaded():
+    if _mirror_is_empty():
+        sync_mirror(force=True)
+
+# Типизированная модель задач: строки из зеркала разбираются один раз на версию данных.
+# Справочные колонки — category, Берем — bool, SP/Reach/Impact — Int64, Confidence — доля (0.8),
+# RICE — float, даты — datetime64. Потребители больше не конвертируют строки сами.
+TASK_CATEGORIES = {'Исполнитель': DEPARTMENTS, 'Заказчик': CLIENTS, 'Приоритет': PRIORITIES, 'Тип': TASK_TYPES}
+TASK_TEXT_COLS = ['Название задачи', 'Описание', 'Кто создал задачу', 'ID', 'Автодаты']
+TASK_INT_COLS = ['Оценка (SP)', 'Reach', 'Impact']
+TASK_DATE_COLS = ['Start date', 'End date']
+
+def parse_task_dates(values):
+    values = values.astype(str).str.strip()
+    parsed = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+    # Даты, введённые руками в листе в русском формате
+    return parsed.fillna(pd.to_datetime(values, format='%d.%m.%Y', errors='coerce'))
+
+def parse_tasks(df_raw):
+    df = pd.DataFrame(index=df_raw.index)
+    df['Берем'] = df_raw['Берем'].astype(str).str.strip().str.upper() == 'TRUE'
+    for col in TASK_TEXT_COLS:
+        df[col] = df_raw[col].astype(str)
+    for col, known in TASK_CATEGORIES.items():
+        values = df_raw[col].astype(str).str.strip()
+        extra = sorted(set(values) - set(known) - {''})
+        df[col] = pd.Categorical(values.where(values != ''), categories=list(known) + extra)
+    df['RICE'] = pd.to_numeric(df_raw['RICE'].astype(str).str.replace(',', '.'), errors='coerce')
+    for col in TASK_INT_COLS:
+        df[col] = pd.to_numeric(df_raw[col], errors='coerce').round().astype('Int64')
+    confidence = df_raw['Confidence'].astype(str).str.strip()
+    is_percent = confidence.str.endswith('%')
+    confidence = pd.to_numeric(confidence.str.rstrip('%').str.replace(',', '.'), errors='coerce')
+    df['Confidence'] = confidence.where(~is_percent, confidence / 100.0)
+    for col in TASK_DATE_COLS:
+        df[col] = parse_task_dates(df_raw[col])
+    return df[EXPECTED_COLS]
+
+def validate_tasks(df_raw, df):
+    named = df_raw['Название задачи'].astype(str).str.strip() != ''
+    issues = []
+    for col, known in TASK_CATEGORIES.items():
+        bad = int((named & df_raw[col].astype(str).str.strip().ne('') & ~df[col].isin(known)).sum())
+        if bad:
+            issues.append(f"{col}: {bad} знач. вне справочника")
+    bad_sp = int((named & df['Оценка (SP)'].notna() & ~df['Оценка (SP)'].isin(SP_OPTIONS)).sum())
+    if bad_sp:
+        issues.append(f"Оценка (SP): {bad_sp} знач. не из {SP_OPTIONS}")
+    for col in TASK_DATE_COLS:
+        bad = int((named & df_raw[col].astype(str).str.strip().ne('') & df[col].isna()).sum())
+        if bad:
+            issues.append(f"{col}: {bad} нераспознанных дат")
+    return issues
+
+# cache_resource: один разобранный фрейм на версию для всех сессий, без копии на каждый вызов —
+# потребители не должны менять его на месте
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_tasks(data_version):
+    with contextlib.closing(mirror_connect()) as conn:
+        df_raw = pd.read_sql_query(f"SELECT row_num, {', '.join(MIRROR_FIELDS)} FROM tasks ORDER BY row_num", conn)
+    # Индекс строки данных i соответствует строке i + 2 листа
+    df_raw.index = df_raw.pop('row_num') - 2
+    df_raw.columns = EXPECTED_COLS
+    df = parse_tasks(df_raw)
+    return df, validate_tasks(df_raw, df)
+
+@traced("load_data")
+def load_data():
+    ensure_mirror_loaded()
+    return load_tasks(mirror_version())[0]
+
+def load_capacity_from_mirror(departments_list):
+    with contextlib.closing(mirror_connect()) as conn:
+        rows = conn.execute("SELECT team, people, days, overhead FROM capacity").fetchall()
+    if not rows:
+        return load_capacity_settings(departments_list)
+
+    settings = {team: {'people': p, 'days': d, 'overhead': o} for team, p, d, o in rows if team in departments_list}
+    for dept in departments_list:
+        if dept not in settings:
+            settings[dept] = {'people': 5, 'days': 21, 'overhead': 20}
+    return settings
+
+def find_active_p0_row(executor_team):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        row = conn.execute(
+            "SELECT row_num FROM tasks WHERE executor = ? AND priority = 'P0 (Critical)' AND type = 'Own Task' "
+            "AND upper(taken) = 'TRUE' ORDER BY row_num LIMIT 1",
+            (executor_team,),
+        ).fetchone()
+    return row[0] if row else None
+
+def mirror_last_filled_row():
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        row = conn.execute("SELECT MAX(row_num) FROM tasks WHERE trim(name) != ''").fetchone()
+    return row[0] or 1
+
+# SP взятых задач по (Исполнитель, Заказчик, Тип). Версия зеркала — ключ кэша: агрегат
+# пересчитывается только когда данные реально поменялись. Общий для графика и Analytics_Data.
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_workload(data_version):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        return pd.read_sql_query(
+            'SELECT executor AS "Исполнитель", client AS "Заказчик", type AS "Тип", '
+            'SUM(CAST(sp AS REAL)) AS "Оценка (SP)" '
+            "FROM tasks WHERE upper(taken) = 'TRUE' GROUP BY executor, client, type ORDER BY executor, client, type",
+            conn,
+        )
+
+# Локальный расчёт RICE для строк, записанных приложением, — до следующей синхронизации
+# зеркала (формулу в таблице считает Google, её значение потом перезапишет это)
+def compute_rice(reach, impact, confidence, sp):
+    try:
+        conf = float(str(confidence).strip().rstrip('%')) / 100.0
+        value = float(reach) * float(impact) * conf / float(sp) * 100
+    except (ValueError, ZeroDivisionError):
+        return ""
+    return str(int(math.floor(value / 10 + 0.5) * 10))
+
+# План начинается с 1-го числа следующего месяца
+def plan_start_date():
+    today = datetime.date.today()
+    if today.month == 12:
+        return datetime.date(today.year + 1, 1, 1)
+    return datetime.date(today.year, today.month + 1, 1)
+
+# Даты без планировщика: задача длится SP дней; если задан один край — второй считается от него
+def plan_task_dates(start_date, end_date, sp_val):
+    next_month_start = plan_start_date()
+
+    if start_date is None and end_date is None:
+        return next_month_start, next_month_start + datetime.timedelta(days=sp_val)
+    if start_date is None:
+        return end_date - datetime.timedelta(days=sp_val), end_date
+    if end_date is None:
+        return start_date, start_date + datetime.timedelta(days=sp_val)
+    return start_date, end_date
+
+# --- 7. СОХРАНЕНИЕ ЗАДАЧ ---
+# Запись строк сериализуется в два уровня. Внутри процесса писатели встают в FIFO, поэтому
+# у процесса не больше одного билета и одного опрашивающего. Между процессами — очередь билетов
+# на листе Write_Lock. Лист — журнал событий (токен, время, waiting/renew/done), строки только
+# дописываются: append в Sheets атомарен, поэтому первая строка токена задаёт порядок, а
+# последняя — срок аренды. Пока писатель ждёт или держит блокировку, фоновый поток продлевает
+# аренду в обход лимитера квоты, так что паузы sheets_call (бюджет, повторы) не отдают
+# блокировку следующему. Под блокировкой держится только поиск строки и запись.
+@st.cache_resource(show_spinner=False)
+def _process_write_queue():
+    return {'cond': threading.Condition(), 'waiting': collections.deque()}
+
+@contextlib.contextmanager
+def process_write_turn():
+    queue = _process_write_queue()
+    me = object()
+    with queue['cond']:
+        queue['waiting'].append(me)
+        if not queue['cond'].wait_for(lambda: queue['waiting'][0] is me, timeout=LOCK_WAIT_SECONDS):
+            queue['waiting'].remove(me)
+            queue['cond'].notify_all()
+            raise TimeoutError("Таблицу сейчас сохраняют другие участники, попробуйте ещё раз.")
+    try:
+        yield
+    finally:
+        with queue['cond']:
+            queue['waiting'].popleft()
+            queue['cond'].notify_all()
+
+@contextlib.contextmanager
+def sheet_write_lock():
+    with process_write_turn(), sheet_lock_ticket() as ticket:
+        yield ticket
+
+# Билет в очереди Write_Lock; вызывается только в свою очередь внутри процесса (process_write_turn).
+# Закрытые билеты срезаются, пока блокировка ещё наша: после "done" лист уже правит следующий
+@contextlib.contextmanager
+def sheet_lock_ticket():
+    ws = get_worksheet(LOCK_SHEET, rows=1000, cols=3)
+    token = uuid.uuid4().hex
+    ws.append_row([token, str(int(time.time())), "waiting"], value_input_option='RAW', table_range='A1')
+    stop_renewal = threading.Event()
+    threading.Thread(target=_renew_lock_ticket, args=(ws, token, stop_renewal), name="lock-renew", daemon=True).start()
+
+    try:
+        ticket = {'token': token, 'queue': wait_for_lock_turn(ws, token)}
+        yield ticket
+        trim_lock_sheet(ws, ticket['queue'])
+    finally:
+        stop_renewal.set()
+        ws.append_row([token, str(int(time.time())), "done"], value_input_option='RAW', table_range='A1')
+
+def _renew_lock_ticket(ws, token, stop):
+    raw_ws = getattr(ws, '_target', ws)
+    while not stop.wait(LOCK_RENEW_SECONDS):
+        try:
+            raw_ws.append_row([token, str(int(time.time())), "renew"], value_input_option='RAW', table_range='A1')
+        except Exception:
+            pass  # следующая попытка через LOCK_RENEW_SECONDS; аренда длиннее двух периодов
+
+# -> (токены в порядке очереди, время последнего события токена, закрытые токены)
+def read_lock_queue(rows):
+    order, last_seen, done = [], {}, set()
+    for row in rows:
+        if len(row) < 3 or not row[1].isdigit():
+            continue
+        token = row[0]
+        if token not in last_seen:
+            order.append(token)
+        last_seen[token] = max(last_seen.get(token, 0), int(row[1]))
+        if row[2] == "done":
+            done.add(token)
+    return order, last_seen, done
+
+def read_lock_queue_rows(ws=None):
+    ws = ws or get_worksheet(LOCK_SHEET, rows=1000, cols=3)
+    return sheets_call('lock', getattr(ws, '_target', ws).get_values, "A1:C")
+
+# Возвращает последнее прочитанное состояние очереди. Опрос идёт в долю квоты 'lock'
+@traced("lock_wait")
+def wait_for_lock_turn(ws, token):
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    delay = LOCK_RETRY_BASE_SECONDS
+    while True:
+        rows = read_lock_queue_rows(ws)
+        order, last_seen, done = read_lock_queue(rows)
+        now = int(time.time())
+        ahead = order[:order.index(token)] if token in order else order
+        blocking = [t for t in ahead if t not in done and now - last_seen[t] < LOCK_LEASE_SECONDS]
+        if not blocking:
+            return rows
+        if time.monotonic() > deadline:
+            raise TimeoutError("Таблицу сейчас сохраняют другие участники, попробуйте ещё раз.")
+        time.sleep(delay + random.uniform(0, delay))
+        delay = min(delay * 2, LOCK_RETRY_MAX_SECONDS)
+
+# Держатель блокировки удаляет сверху строки, все токены которых закрыты или истекли: ссылок на номера
+# строк в журнале нет, порядок оставшихся билетов не меняется, а лист и чтение очереди не растут.
+# rows — очередь, прочитанная при входе: с тех пор строки только дописывались снизу
+def trim_lock_sheet(ws, rows):
+    if len(rows) <= LOCK_TRIM_ROWS:
+        return
+    _, last_seen, done = read_lock_queue(rows)
+    now = int(time.time())
+    finished = 0
+    for row in rows:
+        token = row[0] if row else ""
+        if token in last_seen and token not in done and now - last_seen[token] < LOCK_LEASE_SECONDS:
+            break
+        finished += 1
+    if finished:
+        ws.delete_rows(1, finished)
+
+# Последняя заполненная строка (по колонке B) ищется от подсказки из кэшированного снимка:
+# читается только хвост листа, поэтому цена сохранения не растёт вместе с листом.
+def last_filled_row_in(values, col_idx=1):
+    for i in range(len(values) - 1, -1, -1):
+        row = values[i]
+        if len(row) > col_idx and str(row[col_idx]).strip():
+            return i + 1
+    return 0
+
+@traced("read_tail")
+def read_sheet_tail(sheet):
+    hint_row = mirror_last_filled_row()
+    tail = sheet.get_values(f"A{hint_row}:M")
+
+    if tail and len(tail[0]) > 1 and str(tail[0][1]).strip():
+        return hint_row, tail
+
+    # Снимок устарел (строки удалили вручную) — читаем лист целиком
+    return 1, sheet.get_values("A1:M")
+
+def is_active_p0_row(row, executor_team):
+    return (len(row) > 12 and row[4] == executor_team and row[6] == "P0 (Critical)"
+            and row[12] == "Own Task" and str(row[0]).upper() == 'TRUE')
+
+# Формула RICE строки листа: J = Reach, K = Impact, L = Confidence (%), I = SP
+def rice_formula(row_num):
+    return f'=IFERROR(ROUND(((J{row_num} * K{row_num} * L{row_num}) / I{row_num}) * 100; -1); "")'
+
+# Строки пишутся одним запросом с формулами RICE; при нехватке строк сетка листа расширяется
+@traced("write_rows")
+def write_task_rows(sheet, target_row, values_list):
+    last_row = target_row + len(values_list) - 1
+    if last_row > sheet.row_count:
+        sheet.add_rows(last_row - sheet.row_count)
+
     values_to_append = []
-    for idx, row_df in enumerate(rows_list):
-        row_data = row_df.values.tolist()[0]
-        current_row = target_row + idx
-        
-        # J = Reach, K = Impact, L = Confidence (%), I = SP
-        rice_formula = f'=IFERROR(ROUND(((J{current_row} * K{current_row} * L{current_row}) / I{current_row}) * 100; -1); "")'
-        row_data[7] = rice_formula 
-        values_to_append.append(row_data)
-        
+    for idx, row_data in enumerate(values_list):
+        values_to_append.append(row_data[:7] + [rice_formula(target_row + idx)] + row_data[8:])
+
     sheet.update(range_name=f'A{target_row}', values=values_to_append, value_input_option='USER_ENTERED')
-    
-    all_data = load_data()
-    client = get_client()
-    sync_jira_sheet(client, all_data)
-    update_analytics_tab(client, all_data, st.session_state.capacity_settings, CLIENTS)
+    return values_to_append
+
+@traced("mirror_update")
+def mirror_written_rows(target_row, values_to_append):
+    mirror_upsert_rows(target_row, [
+        row[:7] + [compute_rice(row[9], row[10], row[11], row[8])] + row[8:] for row in values_to_append
+    ])
+
+# Сохранения из формы, пришедшие, пока процесс ждал блокировку, пишутся пакетом: первый
+# дождавшийся очереди забирает все накопленные запросы и пишет их за одно удержание блокировки
+# (одно чтение хвоста, один update). Результат и ошибка раздаются каждому запросу.
+@st.cache_resource(show_spinner=False)
+def _save_queue():
+    return {'lock': threading.Lock(), 'pending': []}
+
+# p0_team: новая строка — P0 этой команды. Если под блокировкой нашёлся чужой P0 (в свежем хвосте
+# листа, в индексе или среди строк того же пакета), строки не пишутся и возвращается номер его строки.
+# downgrade_p0_row: пользователь согласился понизить старый P0 — понижаем его и любые новые P0.
+@traced("save_rows")
+def save_rows(rows_list, p0_team=None, downgrade_p0_row=None):
+    request = {'rows': [row_df.values.tolist()[0] for row_df in rows_list], 'p0_team': p0_team,
+               'downgrade_p0_row': downgrade_p0_row, 'conflict': None, 'error': None}
+    queue = _save_queue()
+    with queue['lock']:
+        queue['pending'].append(request)
+
+    with process_write_turn():
+        with queue['lock']:
+            batch, queue['pending'] = queue['pending'], []
+        # Пусто — наш запрос уже записал предыдущий в очереди
+        if batch:
+            write_save_batch(batch)
+
+    if request['error'] is not None:
+        raise request['error']
+    if request['conflict'] is None:
+        request_derived_sync(st.session_state.capacity_settings)
+    return request['conflict']
+
+@traced("save_batch")
+def write_save_batch(batch):
+    sheet = get_main_sheet()
+    try:
+        before = mirror_revision_before_write()
+        with sheet_lock_ticket() as ticket:
+            start_row, tail = read_sheet_tail(sheet)
+            target_row = start_row + last_filled_row_in(tail)
+            blocks = []
+            for request in batch:
+                team = request['p0_team']
+                if team is not None and not resolve_batch_p0(request, team, start_row, tail, target_row, blocks):
+                    continue
+                blocks.append(request['rows'])
+            written = write_task_rows(sheet, target_row, [row for rows in blocks for row in rows]) if blocks else []
+
+        if written:
+            mirror_written_rows(target_row, written)
+            offsets = itertools.accumulate([0] + [len(rows) for rows in blocks])
+            write_row_dependencies(*[written[a:a + len(rows)] for a, rows in zip(offsets, blocks)])
+            mirror_note_own_write(before, ticket)
+    except Exception as e:
+        for request in batch:
+            request['error'] = e
+
+# Проверка P0 одного запроса пакета: P0 ищутся в хвосте листа, в индексе и в строках пакета,
+# которые уже встали в очередь на запись (blocks). False — конфликт, запрос не пишется.
+def resolve_batch_p0(request, team, start_row, tail, target_row, blocks):
+    p0_rows = {start_row + i for i, row in enumerate(tail) if is_active_p0_row(row, team)}
+    # Хвост видит P0, записанные только что (зеркало их ещё не получило), индекс — все более ранние
+    indexed_row = find_active_p0_row(team)
+    if indexed_row is not None:
+        p0_rows.add(indexed_row)
+    queued = {target_row + i: row for i, row in enumerate(row for rows in blocks for row in rows)
+              if is_active_p0_row(row, team)}
+
+    if request['downgrade_p0_row'] is not None:
+        for row_num in sorted((p0_rows | {request['downgrade_p0_row']}) - set(queued)):
+            downgrade_existing_p0(team, row_num)
+        for row in queued.values():
+            row[6] = "P1 (High)"
+        return True
+    if p0_rows or queued:
+        request['conflict'] = min(p0_rows | set(queued))
+        return False
+    return True
 
 # --- 8. ПОНИЖЕНИЕ ПРИОРИТЕТА ---
-def downgrade_existing_p0(executor_team):
+# Строку старого P0 находит проверка конфликта (через индекс). Перед точечной записью в G
+# строка перечитывается: пока пользователь думал, её могли понизить или сдвинуть.
+@traced("downgrade_p0")
+def downgrade_existing_p0(executor_team, p0_row=None):
+    if p0_row is None:
+        p0_row = find_active_p0_row(executor_team)
+    if p0_row is None:
+        return False
+
     sheet = get_main_sheet()
-    all_values = sheet.get_all_values()
-    for i, row in enumerate(all_values):
-        if i == 0: continue
-        if (len(row) > 12 and row[4] == executor_team and row[6] == "P0 (Critical)" and row[12] == "Own Task"):
-            sheet.update_cell(i + 1, 7, "P1 (High)") 
-            return True
-    return False
-
-# --- ИНИЦИАЛИЗАЦИЯ НАСТРОЕК (ИЗ ГУГЛ ТАБЛИЦЫ) ---
-if 'capacity_settings' not in st.session_state:
-    st.session_state.capacity_settings = load_capacity_settings(get_client(), DEPARTMENTS)
-
-# --- ИНТЕРФЕЙС ---
-st.title("📊 Quarterly Planning Tool")
-
-if st.button("🔄 Обновить данные из Таблицы"):
-    df = load_data()
-    client = get_client()
-    st.session_state.capacity_settings = load_capacity_settings(client, DEPARTMENTS)
-    sync_jira_sheet(client, df)
-    update_analytics_tab(client, df, st.session_state.capacity_settings, CLIENTS)
-    st.rerun()
-
-# КОНФЛИКТ P0
-if 'p0_conflict' not in st.session_state:
-    st.session_state.p0_conflict = False
-    st.session_state.pending_rows = []
-
-if st.session_state.p0_conflict:
-    st.warning(f"⚠️ **Внимание!** У команды уже есть задача с приоритетом P0 (Critical).")
-    st.write("Может быть только 1 крит в плане.")
-    st.write("**Понизить приоритет СУЩЕСТВУЮЩЕГО крита до P1 (High)?**")
-    
-    col_yes, col_no = st.columns(2)
-    with col_yes:
-        if st.button("ДА, понизить старый до P1, новый записать как P0"):
-            executor = st.session_state.pending_rows[0]['Исполнитель'].iloc[0]
-            downgrade_existing_p0(executor)
-            save_rows(st.session_state.pending_rows)
-            st.success("Готово! Перезапись выполнена.")
-            st.session_state.p0_conflict = False
-            st.session_state.pending_rows = []
-            st.rerun()
-    with col_no:
-        if st.button("НЕТ, не трогать старый, новый записать как P1"):
-            rows = st.session_state.pending_rows
-            rows[0]['Приоритет'] = "P1 (High)"
-            if len(rows) > 1:
-                for r in rows[1:]: r['Приоритет'] = "P1 (High)"
-            save_rows(rows)
-            st.success("Готово! Сохранено как P1.")
-            st.session_state.p0_conflict = False
-            st.session_state.pending_rows = []
-            st.rerun()
-    st.stop()
-
-# САЙДБАР (С СОХРАНЕНИЕМ)
-st.sidebar.header("⚙️ Ресурсы команд")
-st.sidebar.info("Укажите значения и нажмите 'Пересчитать графики' в самом низу.")
-
-with st.sidebar.form("capacity_form"):
-    for dept in DEPARTMENTS:
-        with st.expander(f"{dept}", expanded=False):
-            cur_p = st.session_state.capacity_settings[dept].get('people', 5)
-            cur_d = st.session_state.capacity_settings[dept].get('days', 21)
-            cur_o = st.session_state.capacity_settings[dept].get('overhead', 20)
+    current = sheet.get_values(f"A{p0_row}:M{p0_row}")
+    if not current or not is_active_p0_row(current[0], executor_team):
+        return False
+
+    sheet.update_cell(p0_row, 7, "P1 (High)") 
+    mirror_set_priority(p0_row, "P1 (High)")
+    return True
+
+# --- 9. ФОНОВАЯ СИНХРОНИЗАЦИЯ (JIRA + ANALYTICS) ---
+# Производные вкладки обновляет один фоновый поток на процесс. Запросы, пришедшие
+# в течение SYNC_COALESCE_SECONDS, схлопываются в один прогон с последними настройками capacity.
+@st.cache_resource(show_spinner=False)
+def _derived_sync_state():
+    return {
+        'lock': threading.Lock(),
+        'wakeup': threading.Event(),
+        'thread': None,
+        'pending': None,
+        'requested_at': 0.0,
+        'running': False,
+        'last_synced': None,
+        'last_error': None,
+    }
+
+def request_derived_sync(capacity_settings):
+    state = _derived_sync_state()
+    with state['lock']:
+        state['pending'] = {team: dict(vals) for team, vals in capacity_settings.items()}
+        state['requested_at'] = time.monotonic()
+        if state['thread'] is None or not state['thread'].is_alive():
+            state['thread'] = threading.Thread(target=_derived_sync_worker, args=(state,), name="derived-sync", daemon=True)
+            state['thread'].start()
+    state['wakeup'].set()
+
+def _derived_sync_worker(state):
+    while True:
+        state['wakeup'].wait()
+        
+        # Ждём паузы в потоке сохранений, чтобы серия кликов дала один прогон
+        while True:
+            with state['lock']:
+                delay = state['requested_at'] + SYNC_COALESCE_SECONDS - time.monotonic()
+            if delay <= 0:
+                break
+            time.sleep(delay)
+            
+        with state['lock']:
+            capacity_settings = state['pending']
+            state['pending'] = None
+            state['wakeup'].clear()
+            if capacity_settings is None:
+                continue
+            state['running'] = True
             
-            p = st.number_input(f"{dept}: Человек", 1, 100, cur_p, key=f"p_{dept}")
-            d = st.number_input(f"{dept}: Дней", 1, 60, cur_d, key=f"d_{dept}")
-            o = st.number_input(f"{dept}: Threshold (минус от капасити)", 0, 100, cur_o, key=f"o_{dept}")
+        trace = start_trace("derived_sync")
+        try:
+            write_planned_dates(capacity_settings)
+            all_data = load_data()
+            before = mirror_revision_before_write()
+            sync_jira_sheet(all_data)
+            update_analytics_tab(capacity_settings, CLIENTS)
+            mirror_note_own_write(before)
+            error = None
+        except Exception as e:
+            error = str(e)
+        finish_trace(trace)
             
-            st.session_state.capacity_settings[dept] = {'people': p, 'days': d, 'overhead': o}
+        with state['lock']:
+            state['running'] = False
+            state['last_error'] = error
+            if error is None:
+                state['last_synced'] = datetime.datetime.now()
+
+def get_sync_status():
+    state = _derived_sync_state()
+    with state['lock']:
+        return {
+            'pending': state['pending'] is not None or state['running'],
+            'last_synced': state['last_synced'],
+            'last_error': state['last_error'],
+        }
+
+@st.fragment(run_every=SYNC_STATUS_REFRESH_SECONDS)
+def render_sync_status():
+    status = get_sync_status()
+    if status['pending']:
+        st.caption("⏳ Jira/Analytics: синхронизация в очереди...")
+    elif status['last_error']:
+        st.warning(f"⚠️ Синхронизация Jira/Analytics не удалась: {status['last_error']}")
+    elif status['last_synced']:
+        st.caption(f"✅ Jira/Analytics синхронизированы в {status['last_synced'].strftime('%H:%M:%S')}")
+
+    api = get_api_stats()
+    st.caption(f"Sheets API: запросов {api['issued']} · ожиданий квоты {api['throttled']} · "
+               f"повторов {api['retried']} · отказов {api['failed']}")
+
+# --- 10. ДАШБОРД ---
+# Фигура зависит только от (версия зеркала, настройки capacity) и кэшируется по ним:
+# перезапуски от посторонних виджетов не пересчитывают агрегаты и не строят график заново.
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_workload_figure(data_version, cap_key):
+    df_cap = pd.DataFrame([
+        {'Исполнитель': team, 'Real Capacity': real_capacity({'people': p, 'days': d, 'overhead': o})}
+        for team, p, d, o in cap_key
+    ])
+    usage = load_workload(data_version).groupby(['Исполнитель', 'Тип'], as_index=False)['Оценка (SP)'].sum()
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Bar(x=df_cap['Исполнитель'], y=df_cap['Real Capacity'], name='Real Capacity', marker_color='lightgrey', text=df_cap['Real Capacity'], textposition='auto'))
+
+    for t in ['Own Task', 'Incoming Blocker', 'Incoming Enabler']:
+        sub = usage[usage['Тип'] == t]
+        if not sub.empty:
+            fig.add_trace(go.Bar(x=sub['Исполнитель'], y=sub['Оценка (SP)'], name=t, text=sub['Оценка (SP)'], textposition='inside'))
             
-    submit_capacity = st.form_submit_button("📊 Пересчитать графики")
-
-if submit_capacity:
-    client_for_update = get_client()
-    save_capacity_settings(client_for_update, st.session_state.capacity_settings)
-    df_for_update = load_data()
-    update_analytics_tab(client_for_update, df_for_update, st.session_state.capacity_settings, CLIENTS)
-    st.sidebar.success("✅ Значения сохранены в таблицу и графики обновлены!")
-
-# ФОРМА ЗАДАЧИ
-st.subheader("➕ Создание задачи")
-
-with st.form("main_form", clear_on_submit=True):
-    main_team = st.selectbox("Чья задача? (Кто исполнитель)", DEPARTMENTS)
-    task_name = st.text_input("Название задачи", placeholder="Краткая суть...")
-    description = st.text_area("Описание задачи", placeholder="Детали, DoD...", height=100)
-    
-    col_cl, col_pr, col_sp = st.columns(3)
-    with col_cl: client = st.selectbox("Заказчик (Стрим/Продукт)", CLIENTS)
-    with col_pr: priority = st.selectbox("Приоритет", PRIORITIES, index=2)
-    with col_sp: estimate = st.select_slider("Оценка в SP (Своей задачи)", options=SP_OPTIONS, value=1)
-
-    st.markdown("---")
-    
-    # === БЛОК ДАТ ===
-    st.markdown("### 🗓 Сроки (Необязательно)")
-    st.caption("Если оставить пустыми, система начнет задачу со следующего месяца и прибавит SP.")
-    col_sd, col_ed = st.columns(2)
-    with col_sd:
-        start_date_input = st.date_input("Дата начала (Start date)", value=None, format="DD.MM.YYYY")
-    with col_ed:
-        end_date_input = st.date_input("Дата конца (End date)", value=None, format="DD.MM.YYYY")
-
-    st.markdown("---")
-    
-    # === БЛОК RICE ===
-    st.markdown("### 🔬 RICE Оценка (Интуитивно)")
-    
-    col_r, col_i, col_c = st.columns(3)
-    with col_r:
-        reach_val = st.slider("Охват (Reach)", min_value=1, max_value=10, value=5)
-        st.caption("Сколько дашбордов, витрин или систем затронет? (1 = один ad-hoc отчет, 10 = всё DWH или ключевой пайплайн)")
-    with col_i:
-        impact_val = st.slider("Влияние (Impact)", min_value=1, max_value=5, value=3)
-        st.caption("Какая польза бизнесу или архитектуре? (1 = минорный рефакторинг, 5 = спасение прода / х10 ускорение / прямой доход)")
-    with col_c:
-        conf_val_str = st.selectbox("Уверенность (Confidence)", ["100% (Уверен)", "80% (Скорее уверен)", "50% (Интуиция)"])
-        st.caption("Насколько точна наша оценка?")
+    fig.update_layout(barmode='overlay', title="Real Capacity vs Workload")
+    return fig
+
+# --- 11. СПИСОК ЗАДАЧ (ФИЛЬТРЫ И СТРАНИЦЫ) ---
+# Фильтрация, сортировка по RICE и пагинация выполняются в SQLite, в браузер уходит только
+# текущая страница с укороченным описанием.
+PAGE_SIZES = [25, 50, 100]
+DESCRIPTION_PREVIEW_CHARS = 120
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_quarters(data_version):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT quarter FROM tasks WHERE quarter IS NOT NULL ORDER BY quarter DESC"
+        ).fetchall()
+    return [r[0] for r in rows]
+
+def _task_filter_sql(filters, quarter):
+    where = ["trim(name) != ''"]
+    params = []
+    for field, values in filters.items():
+        if values:
+            where.append(f"{field} IN ({', '.join(['?'] * len(values))})")
+            params.extend(values)
+    if quarter:
+        where.append("quarter = ?")
+        params.append(quarter)
+    return " AND ".join(where), params
+
+def count_tasks(filters, quarter):
+    where_sql, params = _task_filter_sql(filters, quarter)
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM tasks WHERE {where_sql}", params).fetchone()[0]
+
+def query_task_page(filters, quarter, rice_desc, page, page_size):
+    where_sql, params = _task_filter_sql(filters, quarter)
+    columns = [f"substr(description, 1, {DESCRIPTION_PREVIEW_CHARS}) || "
+               f"CASE WHEN length(description) > {DESCRIPTION_PREVIEW_CHARS} THEN '…' ELSE '' END"
+               if f == 'description' else f for f in MIRROR_FIELDS]
+    order = "DESC" if rice_desc else "ASC"
+
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        df = pd.read_sql_query(
+            f"SELECT row_num, {', '.join(columns)} FROM tasks WHERE {where_sql} "
+            f"ORDER BY rice = '', CAST(rice AS REAL) {order}, row_num LIMIT ? OFFSET ?",
+            conn,
+            params=params + [page_size, (page - 1) * page_size],
+        )
+    df.columns = ['Строка'] + EXPECTED_COLS
+    return df.set_index('Строка')
+
+@st.fragment
+def render_task_browser():
+    col_ex, col_cl, col_pr, col_tp, col_q = st.columns(5)
+    with col_ex: f_exec = st.multiselect("Исполнитель", DEPARTMENTS, key="tb_exec")
+    with col_cl: f_client = st.multiselect("Заказчик", CLIENTS, key="tb_client")
+    with col_pr: f_prio = st.multiselect("Приоритет", PRIORITIES, key="tb_prio")
+    with col_tp: f_type = st.multiselect("Тип", TASK_TYPES, key="tb_type")
+    with col_q: f_quarter = st.selectbox("Квартал", ["Все"] + load_quarters(mirror_version()), key="tb_quarter")
+
+    col_sort, col_size, col_page = st.columns(3)
+    with col_sort: rice_desc = st.radio("Сортировка по RICE", ["По убыванию", "По возрастанию"], horizontal=True, key="tb_sort") == "По убыванию"
+    with col_size: page_size = st.selectbox("Строк на странице", PAGE_SIZES, key="tb_size")
+
+    filters = {'executor': f_exec, 'client': f_client, 'priority': f_prio, 'type': f_type}
+    quarter = None if f_quarter == "Все" else f_quarter
+
+    total = count_tasks(filters, quarter)
+    pages = max(1, math.ceil(total / page_size))
+    with col_page: page = st.number_input(f"Страница (из {pages})", min_value=1, value=1, key="tb_page")
+
+    df_page = query_task_page(filters, quarter, rice_desc, min(page, pages), page_size)
+    st.caption(f"Найдено задач: {total}")
+    st.dataframe(df_page, use_container_width=True)
+
+# --- 12. МАССОВЫЙ ИМПОРТ (CSV / XLSX) ---
+# Файл с колонками основной таблицы (RICE не нужен — формулу ставит приложение). Обязательны
+# название, исполнитель и заказчик, остальное заполняется как в форме. Все строки проверяются
+# до записи, P0 разрешаются за один проход, запись — одним запросом под блокировкой, после неё
+# одна фоновая синхронизация Jira и Analytics.
+IMPORT_REQUIRED_COLS = ['Название задачи', 'Исполнитель', 'Заказчик']
+IMPORT_DEFAULTS = {'Берем': 'TRUE', 'Приоритет': "P2 (Medium)", 'Reach': "5", 'Impact': "3", 'Confidence': "100%", 'Тип': 'Own Task'}
+IMPORT_MAX_ROWS = 2000
+CONFIDENCE_LEVELS = [1.0, 0.8, 0.5]
+
+def read_import_file(uploaded_file):
+    if uploaded_file.name.lower().endswith(".xlsx"):
+        try:
+            df_in = pd.read_excel(uploaded_file).map(excel_cell_text)
+        except ImportError:
+            raise ValueError("Для чтения XLSX нужен пакет openpyxl — сохраните файл как CSV.")
+    else:
+        # Разделитель определяется сам: Excel в русской локали сохраняет CSV через ";"
+        df_in = pd.read_csv(io.BytesIO(uploaded_file.getvalue()), dtype=str, sep=None, engine='python',
+                            encoding='utf-8-sig', keep_default_na=False)
+    df_in.columns = [str(c).strip() for c in df_in.columns]
+    return df_in.fillna('')
+
+# Ячейки XLSX читаются с родными типами: дата — datetime (str дал бы "2026-12-01 00:00:00"),
+# целое число — float (5.0), флажок — bool. Текстом они становятся в том виде, в каком их пишет форма
+def excel_cell_text(value):
+    if pd.isna(value):
+        return ''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+# Процентная ячейка Excel приходит долей (0.8), руками пишут и "80", и "80%"
+def import_confidence(value):
+    if value.endswith('%'):
+        return value
+    try:
+        number = float(value.replace(',', '.'))
+    except ValueError:
+        return value + '%'
+    return f"{round(number * 100 if number <= 1 else number)}%"
+
+def import_template_csv():
+    return pd.DataFrame(columns=[c for c in EXPECTED_COLS if c not in ('RICE', 'ID', 'Автодаты')]).to_csv(index=False).encode('utf-8-sig')
+
+# Возвращает (строки в порядке EXPECTED_COLS, ошибки "Строка N: ..."); номер строки — как в файле
+def prepare_import_rows(df_in, author_team):
+    missing = [c for c in IMPORT_REQUIRED_COLS if c not in df_in.columns]
+    if missing:
+        return [], [f"В файле нет колонок: {', '.join(missing)}"]
+    if len(df_in) > IMPORT_MAX_ROWS:
+        return [], [f"Слишком много строк: {len(df_in)} (максимум {IMPORT_MAX_ROWS})"]
+
+    df_raw = pd.DataFrame(index=df_in.index)
+    for col in EXPECTED_COLS:
+        values = df_in[col].astype(str).str.strip() if col in df_in.columns else pd.Series('', index=df_in.index)
+        default = author_team if col == 'Кто создал задачу' else IMPORT_DEFAULTS.get(col, '')
+        df_raw[col] = values.where(values != '', default)
+    df_raw['RICE'] = ''
+    df_raw['Автодаты'] = ''
+    df_raw['Берем'] = df_raw['Берем'].str.upper()
+    df_raw['Приоритет'] = df_raw['Приоритет'].map(lambda v: next((p for p in PRIORITIES if p.split()[0] == v.split()[0].upper()), v) if v else v)
+    df_raw['Confidence'] = df_raw['Confidence'].map(import_confidence)
+    df = parse_tasks(df_raw)
+
+    own = df['Тип'] == 'Own Task'
+    checks = [
+        (df_raw['Название задачи'] == '', "пустое название"),
+        (~df_raw['Берем'].isin(['TRUE', 'FALSE']), "Берем — только TRUE/FALSE"),
+        (own & ~df['Оценка (SP)'].isin(SP_OPTIONS), f"SP своей задачи — одно из {SP_OPTIONS}"),
+        (~own & df['Оценка (SP)'].notna() & ~df['Оценка (SP)'].isin(SP_OPTIONS), f"SP — одно из {SP_OPTIONS} или пусто"),
+        (~df['Reach'].between(1, 10).fillna(False).astype(bool), "Reach — целое от 1 до 10"),
+        (~df['Impact'].between(1, 5).fillna(False).astype(bool), "Impact — целое от 1 до 5"),
+        (~df['Confidence'].round(2).isin(CONFIDENCE_LEVELS), "Confidence — 100%, 80% или 50%"),
+        (df['Start date'] > df['End date'], "Start date позже End date"),
+    ]
+    for col in TASK_DATE_COLS:
+        checks.append(((df_raw[col] != '') & df[col].isna(), f"{col} — дата ГГГГ-ММ-ДД или ДД.ММ.ГГГГ"))
+
+    errors = []
+    for pos, idx in enumerate(df.index):
+        problems = [f"{col} «{df_raw.at[idx, col]}» не из справочника"
+                    for col, known in TASK_CATEGORIES.items() if df_raw.at[idx, col] not in known]
+        problems += [msg for mask, msg in checks if mask.iloc[pos]]
+        if problems:
+            errors.append(f"Строка {pos + 2}: " + "; ".join(problems))
+    if errors:
+        return [], errors
+
+    rows = []
+    for idx in df.index:
+        task = df.loc[idx]
+        start = None if pd.isna(task['Start date']) else task['Start date'].date()
+        end = None if pd.isna(task['End date']) else task['End date'].date()
+        rows.append([
+            'TRUE' if task['Берем'] else 'FALSE', df_raw.at[idx, 'Название задачи'], df_raw.at[idx, 'Описание'],
+            df_raw.at[idx, 'Кто создал задачу'], str(task['Исполнитель']), str(task['Заказчик']), str(task['Приоритет']), "",
+            "" if pd.isna(task['Оценка (SP)']) else int(task['Оценка (SP)']), int(task['Reach']), int(task['Impact']),
+            f"{round(task['Confidence'] * 100)}%", str(task['Тип']),
+            start.strftime("%Y-%m-%d") if start else "", end.strftime("%Y-%m-%d") if end else "", new_task_id(),
+        ])
+    return rows, []
+
+# В самом файле у команды остаётся первый по порядку P0, остальные её P0 становятся P1
+def resolve_import_p0(rows):
+    p0_teams, demoted = [], 0
+    for row in rows:
+        if is_active_p0_row(row, row[4]):
+            if row[4] in p0_teams:
+                row[6] = "P1 (High)"
+                demoted += 1
+            else:
+                p0_teams.append(row[4])
+    return p0_teams, demoted
+
+# downgrade_existing: уже существующие P0 команд понижаются до P1; иначе P0 из файла записываются как P1.
+# P0 ищутся в индексе и в свежем хвосте листа под блокировкой (их могли записать только что).
+@traced("import_rows")
+def import_rows(rows, downgrade_existing):
+    p0_teams, _ = resolve_import_p0(rows)
+    sheet = get_main_sheet()
+    downgraded, kept_teams = 0, []
+
+    before = mirror_revision_before_write()
+    with sheet_write_lock() as ticket:
+        start_row, tail = read_sheet_tail(sheet)
+        target_row = start_row + last_filled_row_in(tail)
         
-        conf_map = {"100% (Уверен)": "100%", "80% (Скорее уверен)": "80%", "50% (Интуиция)": "50%"}
-        conf_val_num = conf_map.get(conf_val_str, "100%")
+        for team in p0_teams:
+            existing = {start_row + i for i, row in enumerate(tail) if is_active_p0_row(row, team)}
+            indexed_row = find_active_p0_row(team)
+            if indexed_row is not None:
+                existing.add(indexed_row)
+            if not existing:
+                continue
+            if downgrade_existing:
+                downgraded += sum(downgrade_existing_p0(team, row_num) for row_num in sorted(existing))
+            else:
+                for row in rows:
+                    if is_active_p0_row(row, team):
+                        row[6] = "P1 (High)"
+                kept_teams.append(team)
         
-    st.markdown("---")
-    
-    st.markdown("### 🔗 Зависимость №1")
-    col_d1_1, col_d1_2 = st.columns([1, 2])
-    with col_d1_1: dep1_type = st.radio("Тип №1:", ["Блокер", "Энейблер"], horizontal=True, key="d1_type")
-    with col_d1_2: dep1_team = st.selectbox("Команда №1:", ["(Нет зависимости)"] + DEPARTMENTS, key="d1_team")
-    dep1_name = st.text_input("Название задачи для Команды №1", key="d1_name")
-    dep1_desc = st.text_area("Описание требований №1", height=68, key="d1_desc")
-    
-    st.markdown("---")
-
-    st.markdown("### 🔗 Зависимость №2")
-    col_d2_1, col_d2_2 = st.columns([1, 2])
-    with col_d2_1: dep2_type = st.radio("Тип №2:", ["Блокер", "Энейблер"], horizontal=True, key="d2_type")
-    with col_d2_2: dep2_team = st.selectbox("Команда №2:", ["(Нет зависимости)"] + DEPARTMENTS, key="d2_team")
-    dep2_name = st.text_input("Название задачи для Команды №2", key="d2_name")
-    dep2_desc = st.text_area("Описание требований №2", height=68, key="d2_desc")
-
-    submitted = st.form_submit_button("Сохранить задачу")
-
-    if submitted:
-        if not task_name:
-            st.error("Введите название основной задачи!")
+        values_to_append = write_task_rows(sheet, target_row, rows)
+
+    mirror_written_rows(target_row, values_to_append)
+    write_row_dependencies(values_to_append)
+    mirror_note_own_write(before, ticket)
+    request_derived_sync(st.session_state.capacity_settings)
+    return target_row, downgraded, kept_teams
+
+def render_bulk_import():
+    st.caption("Колонки как в основной таблице. Обязательны: " + ", ".join(IMPORT_REQUIRED_COLS) +
+               ". Пустые поля заполняются как в форме (P2, даты по автоплану команды, Reach 5, Impact 3, 100%).")
+    st.download_button("Скачать шаблон CSV", import_template_csv(), file_name="planning_import_template.csv", mime="text/csv")
+
+    nonce = st.session_state.get('import_nonce', 0)
+    author_team = st.selectbox("Кто создал задачи (если в файле не указано)", DEPARTMENTS, key="imp_author")
+    p0_mode = st.radio("Если у команды уже есть P0 (Critical):",
+                       ["Записать P0 из файла как P1", "Понизить существующий P0 до P1"], key="imp_p0")
+    uploaded = st.file_uploader("Файл CSV или XLSX", type=["csv", "xlsx"], key=f"imp_file_{nonce}")
+    if uploaded is None:
+        return
+
+    try:
+        rows, errors = prepare_import_rows(read_import_file(uploaded), author_team)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return
+    if errors:
+        st.error(f"❌ Файл не импортирован, исправьте ошибки ({len(errors)}):")
+        st.code("\n".join(errors[:50]) + (f"\n… и ещё {len(errors) - 50}" if len(errors) > 50 else ""), language=None)
+        return
+
+    late_deps = schedule_new_rows(rows, st.session_state.capacity_settings)
+    _, demoted_in_file = resolve_import_p0(rows)
+    st.dataframe(pd.DataFrame(rows, columns=EXPECTED_COLS).drop(columns=['RICE', 'Автодаты']).head(20), use_container_width=True)
+    if demoted_in_file:
+        st.info(f"В файле несколько P0 у одной команды: {demoted_in_file} из них будут записаны как P1.")
+    if late_deps:
+        st.warning(f"Не успевают к старту своей задачи по плану команды: {', '.join(late_deps[:10])}"
+                   + (f" и ещё {len(late_deps) - 10}" if len(late_deps) > 10 else ""))
+
+    if st.button(f"Импортировать задач: {len(rows)}", type="primary"):
+        try:
+            target_row, downgraded, kept_teams = import_rows(rows, downgrade_existing=p0_mode.startswith("Понизить"))
+        except TimeoutError as e:
+            st.error(f"❌ {e}")
+            return
+        message = f"Импортировано задач: {len(rows)} (строки {target_row}–{target_row + len(rows) - 1})."
+        if downgraded:
+            message += f" Понижено старых P0: {downgraded}."
+        if kept_teams:
+            message += f" P0 из файла записаны как P1 для: {', '.join(kept_teams)}."
+        st.session_state.import_message = message
+        st.session_state.import_nonce = nonce + 1
+        st.rerun()
+
+# --- 13. АДМИН-ПАНЕЛЬ: РАЗБИВКА ВРЕМЕНИ ПО ЭТАПАМ ---
+# Включается PLANNING_ADMIN_PANEL=1 или ?admin=1. Показывает последние трассы процесса:
+# прогоны (в т.ч. оборванные st.rerun после сохранения) и фоновые синхронизации.
+def render_trace_panel():
+    st.markdown("### 🛠 Трассировка")
+    traces = [t for t in reversed(get_recent_traces()) if t['stages'] or t['api']]
+    if not traces:
+        st.caption("Пока нет прогонов с обращениями к хранилищу.")
+        return
+
+    labels = [f"{t['started']:%H:%M:%S} · {t['name']} · {trace_duration_ms(t):.0f} мс" + (" · прерван" if t['interrupted'] else "")
+              for t in traces]
+    picked = st.selectbox("Прогон", range(len(traces)), format_func=labels.__getitem__, key="trace_pick")
+    trace = traces[picked]
+
+    st.caption("Этапы (вложенные указаны с родителем)")
+    stages = pd.DataFrame(trace['stages'], columns=['stage', 'parent', 'ms']).fillna({'parent': ''})
+    st.dataframe(stages.round({'ms': 1}), hide_index=True, use_container_width=True)
+
+    api = trace_api_breakdown(trace)
+    st.caption(f"Sheets API: {int(api['calls'].sum())} вызовов, {api['ms'].sum():.0f} мс, "
+               f"отправлено ≈{api['sent'].sum() / 1024:.1f} КБ, получено ≈{api['received'].sum() / 1024:.1f} КБ")
+    st.dataframe(api, hide_index=True, use_container_width=True)
+
+# --- 14. АВТОПЛАНИРОВАНИЕ ДАТ ---
+# Даты задач без ручного ввода ставит scheduler.py: дорожки команды по people из capacity
+# (overhead растягивает задачу), порядок по приоритету и RICE, старт не раньше конца блокеров.
+# План живёт в процессе и на новой версии зеркала обновляется по диффу спек, поэтому
+# сохранение задачи не раскладывает весь квартал заново. Задачи с автодатами план двигает:
+# новая более важная задача встаёт перед ними, а сдвинутые даты фоновая синхронизация пишет в лист.
+PRIORITY_RANK = {p: i for i, p in enumerate(PRIORITIES)}
+
+# Строки блокеров/энейблеров форма и импорт пишут сразу после своей задачи тем же автором.
+# Владелец — ближайшая Own Task выше в непрерывном блоке строк автора. По этому правилу новые
+# строки получают рёбра в листе Dependencies, а при первом запуске восстанавливается граф для старых строк.
+def infer_dependency_links(row_nums, authors, types):
+    links = {}
+    owner, owner_author = None, None
+    for row_num, author, task_type in zip(row_nums, authors, types):
+        if task_type == 'Own Task':
+            owner, owner_author = row_num, author
+        elif task_type in TASK_TYPES and owner is not None and author == owner_author:
+            links[row_num] = owner
         else:
-            # === РАСЧЕТ ДАТ ===
-            today = datetime.date.today()
-            if today.month == 12:
-                next_month_start = datetime.date(today.year + 1, 1, 1)
-            else:
-                next_month_start = datetime.date(today.year, today.month + 1, 1)
-
-            sp_val = int(estimate)
-
-            if start_date_input is None and end_date_input is None:
-                final_start = next_month_start
-                final_end = final_start + datetime.timedelta(days=sp_val)
-            elif start_date_input is None and end_date_input is not None:
-                final_end = end_date_input
-                final_start = final_end - datetime.timedelta(days=sp_val)
-            elif start_date_input is not None and end_date_input is None:
-                final_start = start_date_input
-                final_end = final_start + datetime.timedelta(days=sp_val)
+            owner = None
+    return links
+
+# Даты задачи поставлены планировщиком, если совпадают с её автодатами
+def auto_dated_mask(df):
+    planned = df['Start date'].dt.strftime('%Y-%m-%d') + '/' + df['End date'].dt.strftime('%Y-%m-%d')
+    marker = df['Автодаты'].str.strip()
+    return (marker != '') & (planned == marker)
+
+# Рёбра графа переводятся из ID задач в номера строк; links — {строка зависимости: [строки задач, которым она нужна]}.
+# Задачи, закончившиеся до начала плана, в него не входят. Даты, введённые руками, план не двигает:
+# Own Task занимает дорожку от Start до End, зависимость — от Start на свою длительность
+# (End у неё — дедлайн). Недостающий край считается от другого по длительности.
+# Задачи с автодатами планируются заново по приоритету и RICE.
+def task_schedule_specs(df, edges, plan_start, capacity_settings):
+    df = df[df['Берем'] & df['Исполнитель'].notna() & (df['Название задачи'].str.strip() != '')]
+    row_nums = (df.index + 2).tolist()
+    row_by_id = {task_id: row_num for task_id, row_num in zip(df['ID'], row_nums) if task_id}
+    origin = pd.Timestamp(plan_start)
+
+    specs = {}
+    for row_num, team, sp, priority, rice, task_type, start, end, auto in zip(
+            row_nums, df['Исполнитель'].astype(str), df['Оценка (SP)'], df['Приоритет'].astype(object), df['RICE'],
+            df['Тип'].astype(object), df['Start date'], df['End date'], auto_dated_mask(df)):
+        sp = None if pd.isna(sp) else int(sp)
+        fixed = None
+        if pd.notna(start) or pd.notna(end):
+            duration = scheduler.task_duration(sp, capacity_settings.get(team, {}))
+            if pd.notna(start) and (pd.isna(end) or task_type != 'Own Task'):
+                end = start + pd.Timedelta(days=duration)
+            elif pd.isna(start):
+                start = end - pd.Timedelta(days=duration)
+            fixed = ((start - origin).days, (end - origin).days)
+            if fixed[1] < 0:
+                continue
+            if auto:
+                fixed = None
+        specs[row_num] = {
+            'team': team, 'sp': sp, 'priority': PRIORITY_RANK.get(priority, len(PRIORITIES)),
+            'rice': None if pd.isna(rice) else float(rice), 'order': row_num, 'blockers': [], 'fixed': fixed,
+        }
+    links = {}
+    for blocker_id, task_id, kind in edges:
+        dep_row, owner_row = row_by_id.get(blocker_id), row_by_id.get(task_id)
+        if dep_row not in specs or owner_row not in specs:
+            continue
+        links.setdefault(dep_row, []).append(owner_row)
+        if kind in dependency_graph.HARD_KINDS:
+            specs[owner_row]['blockers'].append(dep_row)
+    return specs, links
+
+@st.cache_resource(show_spinner=False)
+def _schedule_cache():
+    return {'lock': threading.Lock(), 'state': None, 'links': {}, 'version': None, 'plan_start': None}
+
+# Вызывается под cache['lock']. Смена месяца (начала плана) сбрасывает план целиком
+def _current_schedule(cache, data_version, capacity_settings):
+    plan_start = plan_start_date()
+    if cache['plan_start'] != plan_start:
+        cache['state'], cache['version'] = None, None
+    if cache['version'] != data_version or cache['state'] is None or cache['state']['capacity'] != capacity_settings:
+        specs, links = task_schedule_specs(load_tasks(data_version)[0], load_dependency_index(data_version)[0],
+                                           plan_start, capacity_settings)
+        cache['state'] = scheduler.update_schedule(cache['state'], specs, capacity_settings)
+        cache['links'], cache['version'], cache['plan_start'] = links, data_version, plan_start
+    return cache['state'], plan_start
+
+# Заполняет пустые даты новых строк (значения в порядке EXPECTED_COLS) по текущему плану.
+# Взятая Own Task без дат планируется целиком, с одной датой — достраивается от неё на SP дней.
+# Зависимость без старта ставится в план своей команды; пустой конец — дедлайн, старт задачи-владельца.
+# Даты, поставленные планом, копируются в Автодаты.
+# Возвращает названия зависимостей, которые по плану своей команды не успевают к дедлайну.
+@traced("schedule")
+def schedule_new_rows(rows, capacity_settings):
+    first_row = mirror_last_filled_row() + 1
+    row_nums = list(range(first_row, first_row + len(rows)))
+    links = infer_dependency_links(row_nums, [r[3] for r in rows], [r[12] for r in rows])
+    by_num = dict(zip(row_nums, rows))
+
+    new_specs = {}
+    for row_num, row in by_num.items():
+        start, end = row[13], row[14]
+        # Невзятые задачи (Берем = FALSE) не занимают дорожки команды
+        if row[12] == 'Own Task' and (start or end or row[0] != 'TRUE'):
+            if not (start and end):
+                parsed = [datetime.date.fromisoformat(v) if v else None for v in (start, end)]
+                row[13], row[14] = (d.strftime("%Y-%m-%d") for d in plan_task_dates(*parsed, int(row[8])))
+            continue
+        if row[12] != 'Own Task' and (start or row[0] != 'TRUE'):
+            continue
+        new_specs[row_num] = {
+            'team': row[4], 'sp': int(row[8]) if str(row[8]).strip() else None,
+            'priority': PRIORITY_RANK.get(row[6], len(PRIORITIES)), 'rice': None, 'order': row_num, 'blockers': [],
+            'fixed': None,
+        }
+        rice = compute_rice(row[9], row[10], row[11], row[8]) if str(row[8]).strip() else ""
+        new_specs[row_num]['rice'] = float(rice) if rice else None
+    for dep_row, owner_row in links.items():
+        if by_num[dep_row][12] == 'Incoming Blocker' and dep_row in new_specs and owner_row in new_specs:
+            new_specs[owner_row]['blockers'].append(dep_row)
+
+    cache = _schedule_cache()
+    with cache['lock']:
+        state, plan_start = _current_schedule(cache, mirror_version(), capacity_settings)
+        placed = scheduler.place_new(state, new_specs)
+
+    def day(offset):
+        return (plan_start + datetime.timedelta(days=offset)).strftime("%Y-%m-%d")
+
+    for row_num in sorted(new_specs, key=lambda r: by_num[r][12] != 'Own Task'):
+        row = by_num[row_num]
+        start, end = placed[row_num]
+        row[13] = day(start)
+        if row[12] == 'Own Task':
+            row[14] = day(end)
+        elif not row[14]:
+            row[14] = by_num[links[row_num]][13] if row_num in links else day(end)
+        row[16] = f"{row[13]}/{row[14]}"
+
+    return [by_num[r][1] for r in new_specs if by_num[r][12] != 'Own Task' and day(placed[r][1]) > by_num[r][14]]
+
+# Задачи с автодатами, чьё место в плане сдвинулось, получают новые даты в листе. Запись — под
+# блокировкой по перечитанным колонкам N:Q: строка ищется по ID, и даты пишутся, только если
+# их с тех пор не правили руками. Возвращает число переписанных задач.
+@traced("write_planned_dates")
+def write_planned_dates(capacity_settings):
+    data_version = mirror_version()
+    cache = _schedule_cache()
+    with cache['lock']:
+        state, plan_start = _current_schedule(cache, data_version, capacity_settings)
+        placed = {tid: (start, end) for tid, (start, end, _) in state['placed'].items()}
+        links = {tid: list(owners) for tid, owners in cache['links'].items()}
+
+    def day(offset):
+        return (plan_start + datetime.timedelta(days=offset)).strftime("%Y-%m-%d")
+
+    df = load_tasks(data_version)[0]
+    df = df[auto_dated_mask(df) & (df['ID'].str.strip() != '')]
+    changes = {}
+    for row_num, task_id, task_type, marker in zip(df.index + 2, df['ID'].str.strip(), df['Тип'], df['Автодаты'].str.strip()):
+        if row_num not in placed:
+            continue
+        start, end = placed[row_num]
+        if task_type != 'Own Task':
+            # Дедлайн зависимости — старт задачи, которой она нужна, как при сохранении
+            owner_starts = [placed[owner][0] for owner in links.get(row_num, ()) if owner in placed]
+            end = min(owner_starts, default=end)
+        planned = f"{day(start)}/{day(end)}"
+        if planned != marker:
+            changes[task_id] = (marker, planned)
+    if not changes:
+        return 0
+
+    sheet = get_main_sheet()
+    before = mirror_revision_before_write()
+    with sheet_write_lock() as ticket:
+        updates, rewritten = [], []
+        for row_num, row in enumerate(sheet.get_values("N2:Q"), start=2):
+            row = row + [""] * (4 - len(row))
+            marker, planned = changes.get(row[2].strip(), (None, None))
+            current = parse_task_dates(pd.Series(row[:2])).dt.strftime('%Y-%m-%d')
+            if marker is None or row[3].strip() != marker or "/".join(current.fillna('')) != marker:
+                continue
+            updates.append({'range': f"N{row_num}:O{row_num}", 'values': [planned.split("/")]})
+            updates.append({'range': f"Q{row_num}", 'values': [[planned]]})
+            rewritten.append((row_num, planned))
+        if updates:
+            sheet.batch_update(updates, value_input_option='USER_ENTERED')
+
+    if rewritten:
+        mirror_set_dates(rewritten)
+        mirror_note_own_write(before, ticket)
+    return len(rewritten)
+
+def schedule_frame(data_version, capacity_settings, team):
+    cache = _schedule_cache()
+    with cache['lock']:
+        state, plan_start = _current_schedule(cache, data_version, capacity_settings)
+        over = scheduler.over_capacity(state)
+        rows = [(tid, start, end) for tid in state['sequence'] if state['specs'][tid]['team'] == team
+                for start, end, _ in [state['placed'][tid]]]
+        links = {tid: [o for o in owners if o in state['placed']] for tid, owners in cache['links'].items()}
+        owner_start = {o: state['placed'][o][0] for owners in links.values() for o in owners}
+
+    df = load_tasks(data_version)[0]
+    out = pd.DataFrame({
+        'Строка': [tid for tid, _, _ in rows],
+        'Название задачи': [df.at[tid - 2, 'Название задачи'] for tid, _, _ in rows],
+        'Приоритет': [df.at[tid - 2, 'Приоритет'] for tid, _, _ in rows],
+        'Тип': [df.at[tid - 2, 'Тип'] for tid, _, _ in rows],
+        'Оценка (SP)': [df.at[tid - 2, 'Оценка (SP)'] for tid, _, _ in rows],
+        'План: старт': [plan_start + datetime.timedelta(days=start) for _, start, _ in rows],
+        'План: конец': [plan_start + datetime.timedelta(days=end) for _, _, end in rows],
+        'Сверх capacity': [tid in over for tid, _, _ in rows],
+        'Опаздывает к задаче': [any(end > owner_start[o] for o in links.get(tid, ())) for tid, _, end in rows],
+    })
+    return out.set_index('Строка')
+
+def render_schedule_view():
+    team = st.selectbox("Команда", DEPARTMENTS, key="sched_team")
+    df_plan = schedule_frame(mirror_version(), st.session_state.capacity_settings, team)
+    st.caption(f"Задач в плане: {len(df_plan)} · сверх capacity: {int(df_plan['Сверх capacity'].sum())} · "
+               f"зависимостей с опозданием: {int(df_plan['Опаздывает к задаче'].sum())}")
+    st.dataframe(df_plan, use_container_width=True)
+
+# --- 15. ГРАФ ЗАВИСИМОСТЕЙ ---
+# У каждой задачи стабильный ID (колонка ID основного листа), связи "блокер -> задача" хранятся
+# по ID в листе Dependencies и в зеркале. Индекс смежности из dependency_graph.py строится раз на
+# версию данных и отвечает на запросы ревью: кого транзитивно держит задача, резерв, критический путь.
+def new_task_id():
+    return f"T-{uuid.uuid4().hex[:10]}"
+
+# Строкам без ID (старые данные, строки добавлены руками) и копиям чужого ID новый ID проставляется одним запросом
+def _missing_id_updates(rows):
+    id_idx = EXPECTED_COLS.index('ID')
+    updates, seen = [], set()
+    for i, row in enumerate(rows):
+        if not (len(row) > 1 and str(row[1]).strip()):
+            continue
+        row += [""] * (id_idx + 1 - len(row))
+        task_id = str(row[id_idx]).strip()
+        if task_id and task_id not in seen:
+            seen.add(task_id)
+        else:
+            row[id_idx] = new_task_id()
+            seen.add(row[id_idx])
+            updates.append({'range': f"{col_letter(id_idx + 1)}{i + 2}", 'values': [[row[id_idx]]]})
+    return updates
+
+# Возвращает строки с ID. Запись идёт под блокировкой по перечитанному листу: иначе
+# ID попали бы не в те строки, если кто-то успел дописать или переписать лист
+def assign_missing_task_ids(rows):
+    if not _missing_id_updates([list(row) for row in rows]):
+        return rows
+    with sheet_write_lock():
+        rows = fetch_sheet_values()[1:]
+        updates = _missing_id_updates(rows)
+        if updates:
+            get_main_sheet().batch_update(updates)
+    return rows
+
+# Заголовок сверяется по префиксу: справа от него могут дописать свои колонки.
+# Строки связей, дописанные в лист до заголовка (или при чужом заголовке), тоже читаются
+def parse_dependency_values(values):
+    if values and values[0][:len(DEPENDENCY_COLS)] == DEPENDENCY_COLS:
+        values = values[1:]
+    return [tuple(r[:3]) for r in values if len(r) >= 3 and r[0] and r[1]]
+
+def dependency_sheet_is_empty(values):
+    return not any(str(cell).strip() for row in values for cell in row)
+
+# rows — строки данных листа задач (с ID). Только если листа связей нет или он пуст, граф
+# восстанавливается по порядку строк (см. infer_dependency_links) и записывается целиком
+def load_dependency_sheet(rows):
+    ws = get_worksheet(DEPENDENCY_SHEET, rows=1000, cols=len(DEPENDENCY_COLS))
+    values = ws.get_all_values()
+    if not dependency_sheet_is_empty(values):
+        return parse_dependency_values(values)
+
+    named = [(i + 2, row) for i, row in enumerate(rows) if len(row) > 15 and str(row[1]).strip()]
+    by_num = dict(named)
+    links = infer_dependency_links([n for n, _ in named], [r[3] for _, r in named], [r[12] for _, r in named])
+    edges = [(by_num[dep][15], by_num[owner][15], by_num[dep][12]) for dep, owner in links.items()]
+    created = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ws.update(range_name='A1', values=[DEPENDENCY_COLS] + [list(edge) + [created] for edge in edges])
+    return edges
+
+# Рёбра между только что записанными строками (зависимости формы/импорта -> их задача).
+# blocks — строки отдельных отправок (пакет сохранений): связи не переходят границу отправки
+@traced("write_dependencies")
+def write_row_dependencies(*blocks):
+    edges = []
+    for rows in blocks:
+        links = infer_dependency_links(range(len(rows)), [r[3] for r in rows], [r[12] for r in rows])
+        edges += [(rows[dep][15], rows[owner][15], rows[dep][12]) for dep, owner in links.items()]
+    if not edges:
+        return
+    created = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    get_worksheet(DEPENDENCY_SHEET, rows=1000, cols=len(DEPENDENCY_COLS)).append_rows(
+        [list(edge) + [created] for edge in edges], value_input_option='RAW', table_range='A1')
+    mirror_add_edges(edges)
+
+# Ручная связь двух существующих задач. Под блокировкой граф перечитывается из листа,
+# чтобы проверка цикла видела связи, добавленные другими участниками только что
+@traced("add_dependency")
+def add_dependency(blocker_id, task_id, kind):
+    ws = get_worksheet(DEPENDENCY_SHEET, rows=1000, cols=len(DEPENDENCY_COLS))
+    before = mirror_revision_before_write()
+    with sheet_write_lock() as ticket:
+        values = ws.get_all_values()
+        if dependency_sheet_is_empty(values):
+            raise ValueError("Лист связей ещё не создан — нажмите «Обновить данные из Таблицы».")
+        index = dependency_graph.build_index(parse_dependency_values(values))
+        if task_id in index['succ'].get(blocker_id, {}):
+            raise ValueError("Такая связь уже есть.")
+        if dependency_graph.creates_cycle(index, blocker_id, task_id):
+            raise ValueError("Связь замкнёт цикл зависимостей.")
+        ws.append_row([blocker_id, task_id, kind, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")],
+                      value_input_option='RAW', table_range='A1')
+    mirror_add_edges([(blocker_id, task_id, kind)])
+    mirror_note_own_write(before, ticket)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_dependency_index(data_version):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        edges = conn.execute("SELECT blocker_id, task_id, kind FROM dependencies ORDER BY rowid").fetchall()
+    return edges, dependency_graph.build_index(edges)
+
+# Ранние/поздние сроки и резерв взятых задач; длительность — как у планировщика (SP и overhead команды)
+@st.cache_data(max_entries=8, show_spinner=False)
+def dependency_metrics(data_version, cap_key):
+    capacity = {team: {'people': p, 'days': d, 'overhead': o} for team, p, d, o in cap_key}
+    df = load_tasks(data_version)[0]
+    df = df[df['Берем'] & (df['ID'] != '')]
+    durations = {
+        task_id: scheduler.task_duration(None if pd.isna(sp) else int(sp), capacity.get(str(team), {}))
+        for task_id, sp, team in zip(df['ID'], df['Оценка (SP)'], df['Исполнитель'])
+    }
+    return dependency_graph.path_metrics(load_dependency_index(data_version)[1], durations)
+
+def render_dependency_view():
+    data_version = mirror_version()
+    edges, index = load_dependency_index(data_version)
+    metrics = dependency_metrics(data_version, capacity_key(st.session_state.capacity_settings))
+    df = load_tasks(data_version)[0]
+    df = df[df['ID'] != ''].drop_duplicates('ID')
+    if df.empty:
+        st.caption("Задач пока нет.")
+        return
+    tasks = df.set_index('ID')
+    st.caption(f"Связей: {len(edges)}")
+
+    cycled = dependency_graph.find_cycles(index)
+    if cycled:
+        st.warning(f"⚠️ Цикл зависимостей (правки в листе {DEPENDENCY_SHEET}): "
+                   + ", ".join(tasks.at[t, 'Название задачи'] for t in sorted(cycled) if t in tasks.index))
+
+    def describe(task_ids):
+        ids = [t for t in task_ids if t in tasks.index]
+        return pd.DataFrame({
+            'ID': ids,
+            'Название задачи': [tasks.at[t, 'Название задачи'] for t in ids],
+            'Исполнитель': [tasks.at[t, 'Исполнитель'] for t in ids],
+            'Резерв (дн.)': [metrics[t]['slack'] if t in metrics else None for t in ids],
+        })
+
+    labels = dict(zip(df['ID'], df['Название задачи'] + " · " + df['Исполнитель'].astype(str)))
+    st.markdown("**Критический путь команд**")
+    paths = []
+    for team in DEPARTMENTS:
+        path = dependency_graph.critical_path(index, metrics, df.loc[df['Исполнитель'] == team, 'ID'])
+        if len(path) > 1:
+            paths.append({'Команда': team, 'Длина (дн.)': metrics[path[-1]]['ef'],
+                          'Цепочка': " → ".join(tasks.at[t, 'Название задачи'] for t in path)})
+    if paths:
+        st.dataframe(pd.DataFrame(paths), hide_index=True, use_container_width=True)
+    else:
+        st.caption("Цепочек блокеров пока нет.")
+
+    linked = [t for t in labels if t in index['succ'] or t in index['pred']]
+    task_id = st.selectbox("Задача", linked, format_func=labels.get, key="dep_task") if linked else None
+    if task_id is not None:
+        if task_id in metrics:
+            st.caption(f"Резерв задачи: {metrics[task_id]['slack']} дн.")
+        col_down, col_up = st.columns(2)
+        with col_down:
+            st.caption("Транзитивно заблокированы ею")
+            st.dataframe(describe(dependency_graph.downstream(index, task_id)), hide_index=True, use_container_width=True)
+        with col_up:
+            st.caption("Её транзитивно блокируют")
+            st.dataframe(describe(dependency_graph.upstream(index, task_id)), hide_index=True, use_container_width=True)
+
+    with st.form("dependency_form"):
+        st.markdown("**Новая связь**")
+        blocker_id = st.selectbox("Что нужно сделать раньше", list(labels), format_func=labels.get, key="dep_from")
+        dependent_id = st.selectbox("Какую задачу это держит", list(labels), format_func=labels.get, key="dep_to")
+        kind = st.radio("Тип связи", TASK_TYPES[1:], horizontal=True, key="dep_kind")
+        if st.form_submit_button("Связать"):
+            try:
+                add_dependency(blocker_id, dependent_id, kind)
+            except (ValueError, TimeoutError) as e:
+                st.error(f"❌ {e}")
             else:
-                final_start = start_date_input
-                final_end = end_date_input
+                st.rerun()
+
+# --- 16. АРХИВ КВАРТАЛОВ ---
+# Закрытые кварталы переезжают из основного листа в листы "Archive ГГГГ-QN": основной лист,
+# зеркало, Jira и Analytics дальше работают только с текущими и будущими кварталами.
+# Архив только читается — при открытии истории, один раз на лист.
+ARCHIVE_SHEET_PREFIX = "Archive "
+
+# [2, 3, 4, 7, 9, 10] -> [(2, 4), (7, 7), (9, 10)]
+def consecutive_runs(nums):
+    runs = []
+    for num in nums:
+        if runs and runs[-1][1] == num - 1:
+            runs[-1] = (runs[-1][0], num)
+        else:
+            runs.append((num, num))
+    return runs
+
+def row_quarter(row):
+    return plan_quarter(row[13], row[14])
+
+def current_quarter():
+    today = datetime.date.today()
+    return f"{today.year}-Q{(today.month + 2) // 3}"
+
+# Строки квартала дописываются в его архивный лист (ID, которые там уже есть, пропускаются — повтор
+# после сбоя не дублирует), затем удаляются из основного листа одним batch_update с deleteDimension
+# снизу вверх. Удаляются строки целиком: колонки правее ID, заметки и форматирование остаются при
+# своих задачах, а RICE-формулы Sheets сдвигает сам. Всё под блокировкой записи; номера строк
+# меняются, поэтому зеркало после этого сверяется целиком.
+@traced("archive_quarter")
+def archive_quarter(quarter):
+    if quarter >= current_quarter():
+        raise ValueError(f"Квартал {quarter} ещё не закрыт.")
+    sheet = get_main_sheet()
+
+    with sheet_write_lock():
+        raw_data = fetch_sheet_values()
+        rows = [row + [""] * (len(EXPECTED_COLS) - len(row)) for row in raw_data[1:]]
+        archived_nums = [i + 2 for i, row in enumerate(rows) if str(row[1]).strip() and row_quarter(row) == quarter]
+        if not archived_nums:
+            return 0
+        archived = [rows[num - 2] for num in archived_nums]
+
+        ws_archive = get_worksheet(ARCHIVE_SHEET_PREFIX + quarter, rows=len(archived) + 1, cols=len(EXPECTED_COLS))
+        existing = ws_archive.get_all_values()
+        if not existing or existing[0] != EXPECTED_COLS:
+            ws_archive.update(range_name='A1', values=[EXPECTED_COLS] + archived, value_input_option='RAW')
+        else:
+            known_ids = {r[15] for r in existing[1:] if len(r) > 15}
+            fresh = [row for row in archived if row[15] not in known_ids]
+            if fresh:
+                ws_archive.append_rows(fresh, value_input_option='RAW', table_range='A1')
+
+        get_spreadsheet().batch_update({'requests': [
+            {'deleteDimension': {'range': {'sheetId': sheet.id, 'dimension': 'ROWS', 'startIndex': first - 1, 'endIndex': last}}}
+            for first, last in reversed(consecutive_runs(archived_nums))
+        ]})
+
+    load_archive_titles.clear()
+    load_archived_quarter.clear()
+    sync_mirror(force=True)
+    request_derived_sync(st.session_state.capacity_settings)
+    return len(archived)
+
+@st.cache_data(show_spinner=False)
+def load_archive_titles():
+    titles = [ws.title for ws in get_spreadsheet().worksheets() if ws.title.startswith(ARCHIVE_SHEET_PREFIX)]
+    return sorted(titles)
+
+# SP и число взятых задач по командам за архивный квартал
+@st.cache_data(show_spinner=False)
+def load_archived_quarter(title):
+    values = get_worksheet(title).get_all_values()
+    rows = [row[:len(EXPECTED_COLS)] + [""] * (len(EXPECTED_COLS) - len(row)) for row in values[1:]]
+    df = parse_tasks(pd.DataFrame(rows, columns=EXPECTED_COLS, dtype=str))
+    df = df[df['Берем']]
+    out = df.groupby('Исполнитель', observed=True).agg(tasks=('Название задачи', 'size'), sp=('Оценка (SP)', 'sum'))
+    return out.reset_index().assign(quarter=title[len(ARCHIVE_SHEET_PREFIX):])
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_live_quarter_workload(data_version):
+    _mirror_state()
+    with contextlib.closing(mirror_connect()) as conn:
+        return pd.read_sql_query(
+            'SELECT quarter, executor AS "Исполнитель", COUNT(*) AS tasks, SUM(CAST(sp AS REAL)) AS sp '
+            "FROM tasks WHERE upper(taken) = 'TRUE' AND trim(name) != '' AND quarter IS NOT NULL "
+            "GROUP BY quarter, executor",
+            conn,
+        )
+
+def render_quarter_archive():
+    closed = [q for q in load_quarters(mirror_version()) if q < current_quarter()]
+    if closed:
+        col_q, col_btn = st.columns([2, 1])
+        with col_q: quarter = st.selectbox("Закрытый квартал в основном листе", closed, key="arch_quarter")
+        with col_btn:
+            confirm = st.checkbox("Перенести в архив", key="arch_confirm")
+            if st.button("🗄 Архивировать", disabled=not confirm):
+                try:
+                    moved = archive_quarter(quarter)
+                except (ValueError, TimeoutError) as e:
+                    st.error(f"❌ {e}")
+                else:
+                    st.session_state.archive_message = f"Квартал {quarter} перенесён в архив: задач {moved}."
+                    st.rerun()
+    else:
+        st.caption("В основном листе нет закрытых кварталов.")
+
+    if not st.toggle("Показать историю по кварталам", key="arch_history"):
+        return
+    history = [load_archived_quarter(title) for title in load_archive_titles()]
+    df = pd.concat(history + [load_live_quarter_workload(mirror_version())], ignore_index=True)
+    if df.empty:
+        st.caption("Истории пока нет.")
+        return
+    df['Исполнитель'] = df['Исполнитель'].astype(str)
+    pivot = df.pivot_table(index='quarter', columns='Исполнитель', values='sp', aggfunc='sum').sort_index()
+
+    fig = go.Figure()
+    for team in pivot.columns:
+        fig.add_trace(go.Bar(x=pivot.index, y=pivot[team], name=team))
+    fig.update_layout(barmode='group', title="SP взятых задач по кварталам")
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(df.pivot_table(index='quarter', columns='Исполнитель', values='tasks', aggfunc='sum').sort_index(),
+                 use_container_width=True)
+
+# --- ТОЧКА ВХОДА ---
+# Интерфейс собран в main(): при импорте модуля (например, из benchmark.py) выполняются только определения
+def main():
+    # --- ИНИЦИАЛИЗАЦИЯ НАСТРОЕК (ИЗ ГУГЛ ТАБЛИЦЫ) ---
+    # Трасса прошлого прогона, если его оборвал st.rerun()/st.stop(), закрывается здесь
+    finish_trace(st.session_state.get('trace'), interrupted=True)
+    st.session_state.trace = start_trace("rerun")
+    ensure_mirror_worker()
+
+    if 'capacity_settings' not in st.session_state:
+        st.session_state.capacity_settings = load_capacity_from_mirror(DEPARTMENTS)
+
+    # --- ИНТЕРФЕЙС ---
+    st.title("📊 Quarterly Planning Tool")
+
+    mirror_status = get_mirror_status()
+    if mirror_status['last_error']:
+        synced_at = mirror_status['last_synced'].strftime('%H:%M:%S') if mirror_status['last_synced'] else "—"
+        st.warning(f"⚠️ Google Sheets недоступен, показана локальная копия (синхронизирована в {synced_at}). "
+                   f"Сохранение задач может не пройти. Ошибка: {mirror_status['last_error']}")
+
+    if st.button("🔄 Обновить данные из Таблицы"):
+        reset_connection()
+        sync_mirror(force=True)
+        st.session_state.capacity_settings = load_capacity_from_mirror(DEPARTMENTS)
+        request_derived_sync(st.session_state.capacity_settings)
+        st.rerun()
+
+    # КОНФЛИКТ P0
+    if 'p0_conflict' not in st.session_state:
+        st.session_state.p0_conflict = False
+        st.session_state.p0_conflict_row = None
+        st.session_state.pending_rows = []
+
+    if st.session_state.p0_conflict:
+        st.warning(f"⚠️ **Внимание!** У команды уже есть задача с приоритетом P0 (Critical).")
+        st.write("Может быть только 1 крит в плане.")
+        st.write("**Понизить приоритет СУЩЕСТВУЮЩЕГО крита до P1 (High)?**")
+
+        col_yes, col_no = st.columns(2)
+        with col_yes:
+            if st.button("ДА, понизить старый до P1, новый записать как P0"):
+                executor = st.session_state.pending_rows[0]['Исполнитель'].iloc[0]
+                try:
+                    save_rows(st.session_state.pending_rows, p0_team=executor,
+                              downgrade_p0_row=st.session_state.get('p0_conflict_row'))
+                except TimeoutError as e:
+                    st.error(f"❌ {e}")
+                    st.stop()
+                st.success("Готово! Перезапись выполнена.")
+                st.session_state.p0_conflict = False
+                st.session_state.p0_conflict_row = None
+                st.session_state.pending_rows = []
+                st.rerun()
+        with col_no:
+            if st.button("НЕТ, не трогать старый, новый записать как P1"):
+                rows = st.session_state.pending_rows
+                rows[0]['Приоритет'] = "P1 (High)"
+                if len(rows) > 1:
+                    for r in rows[1:]: r['Приоритет'] = "P1 (High)"
+                try:
+                    save_rows(rows)
+                except TimeoutError as e:
+                    st.error(f"❌ {e}")
+                    st.stop()
+                st.success("Готово! Сохранено как P1.")
+                st.session_state.p0_conflict = False
+                st.session_state.p0_conflict_row = None
+                st.session_state.pending_rows = []
+                st.rerun()
+        st.stop()
+
+    # САЙДБАР (С СОХРАНЕНИЕМ)
+    st.sidebar.header("⚙️ Ресурсы команд")
+    st.sidebar.info("Укажите значения и нажмите 'Пересчитать графики' в самом низу.")
+
+    with st.sidebar:
+        render_sync_status()
+
+    with st.sidebar.form("capacity_form"):
+        for dept in DEPARTMENTS:
+            with st.expander(f"{dept}", expanded=False):
+                cur_p = st.session_state.capacity_settings[dept].get('people', 5)
+                cur_d = st.session_state.capacity_settings[dept].get('days', 21)
+                cur_o = st.session_state.capacity_settings[dept].get('overhead', 20)
+            
+                p = st.number_input(f"{dept}: Человек", 1, 100, cur_p, key=f"p_{dept}")
+                d = st.number_input(f"{dept}: Дней", 1, 60, cur_d, key=f"d_{dept}")
+                o = st.number_input(f"{dept}: Threshold (минус от капасити)", 0, 100, cur_o, key=f"o_{dept}")
+            
+                st.session_state.capacity_settings[dept] = {'people': p, 'days': d, 'overhead': o}
+            
+        submit_capacity = st.form_submit_button("📊 Пересчитать графики")
+
+    if submit_capacity:
+        try:
+            before = mirror_revision_before_write()
+            save_capacity_settings(st.session_state.capacity_settings)
+        except TimeoutError as e:
+            st.sidebar.error(f"❌ {e}")
+            st.stop()
+        mirror_save_capacity(st.session_state.capacity_settings)
+        mirror_note_own_write(before)
+        request_derived_sync(st.session_state.capacity_settings)
+        st.sidebar.success("✅ Значения сохранены в таблицу и графики обновлены!")
+
+    # ФОРМА ЗАДАЧИ
+    st.subheader("➕ Создание задачи")
+    if st.session_state.get('schedule_warning'):
+        st.warning(st.session_state.pop('schedule_warning'))
+
+    with st.form("main_form", clear_on_submit=True):
+        main_team = st.selectbox("Чья задача? (Кто исполнитель)", DEPARTMENTS)
+        task_name = st.text_input("Название задачи", placeholder="Краткая суть...")
+        description = st.text_area("Описание задачи", placeholder="Детали, DoD...", height=100)
+
+        col_cl, col_pr, col_sp = st.columns(3)
+        with col_cl: client = st.selectbox("Заказчик (Стрим/Продукт)", CLIENTS)
+        with col_pr: priority = st.selectbox("Приоритет", PRIORITIES, index=2)
+        with col_sp: estimate = st.select_slider("Оценка в SP (Своей задачи)", options=SP_OPTIONS, value=1)
+
+        st.markdown("---")
+
+        # === БЛОК ДАТ ===
+        st.markdown("### 🗓 Сроки (Необязательно)")
+        st.caption("Если оставить пустыми, система поставит задачу в план команды с учетом capacity, приоритета, RICE и блокеров.")
+        col_sd, col_ed = st.columns(2)
+        with col_sd:
+            start_date_input = st.date_input("Дата начала (Start date)", value=None, format="DD.MM.YYYY")
+        with col_ed:
+            end_date_input = st.date_input("Дата конца (End date)", value=None, format="DD.MM.YYYY")
+
+        st.markdown("---")
+
+        # === БЛОК RICE ===
+        st.markdown("### 🔬 RICE Оценка (Интуитивно)")
+
+        col_r, col_i, col_c = st.columns(3)
+        with col_r:
+            reach_val = st.slider("Охват (Reach)", min_value=1, max_value=10, value=5)
+            st.caption("Сколько дашбордов, витрин или систем затронет? (1 = один ad-hoc отчет, 10 = всё DWH или ключевой пайплайн)")
+        with col_i:
+            impact_val = st.slider("Влияние (Impact)", min_value=1, max_value=5, value=3)
+            st.caption("Какая польза бизнесу или архитектуре? (1 = минорный рефакторинг, 5 = спасение прода / х10 ускорение / прямой доход)")
+        with col_c:
+            conf_val_str = st.selectbox("Уверенность (Confidence)", ["100% (Уверен)", "80% (Скорее уверен)", "50% (Интуиция)"])
+            st.caption("Насколько точна наша оценка?")
+        
+            conf_map = {"100% (Уверен)": "100%", "80% (Скорее уверен)": "80%", "50% (Интуиция)": "50%"}
+            conf_val_num = conf_map.get(conf_val_str, "100%")
+        
+        st.markdown("---")
+
+        st.markdown("### 🔗 Зависимость №1")
+        col_d1_1, col_d1_2 = st.columns([1, 2])
+        with col_d1_1: dep1_type = st.radio("Тип №1:", ["Блокер", "Энейблер"], horizontal=True, key="d1_type")
+        with col_d1_2: dep1_team = st.selectbox("Команда №1:", ["(Нет зависимости)"] + DEPARTMENTS, key="d1_team")
+        dep1_name = st.text_input("Название задачи для Команды №1", key="d1_name")
+        dep1_desc = st.text_area("Описание требований №1", height=68, key="d1_desc")
+
+        st.markdown("---")
+
+        st.markdown("### 🔗 Зависимость №2")
+        col_d2_1, col_d2_2 = st.columns([1, 2])
+        with col_d2_1: dep2_type = st.radio("Тип №2:", ["Блокер", "Энейблер"], horizontal=True, key="d2_type")
+        with col_d2_2: dep2_team = st.selectbox("Команда №2:", ["(Нет зависимости)"] + DEPARTMENTS, key="d2_team")
+        dep2_name = st.text_input("Название задачи для Команды №2", key="d2_name")
+        dep2_desc = st.text_area("Описание требований №2", height=68, key="d2_desc")
+
+        submitted = st.form_submit_button("Сохранить задачу")
 
-            str_start = final_start.strftime("%Y-%m-%d")
-            str_end = final_end.strftime("%Y-%m-%d")
+        if submitted:
+            if not task_name:
+                st.error("Введите название основной задачи!")
+            else:
+                str_start = start_date_input.strftime("%Y-%m-%d") if start_date_input else ""
+                str_end = end_date_input.strftime("%Y-%m-%d") if end_date_input else ""
 
-            rows_to_save = []
+                rows_to_save = []
+            
+                # Основная задача
+                rows_to_save.append(pd.DataFrame([{
+                    'Берем': 'TRUE', 
+                    'Название задачи': task_name,
+                    'Описание': description,
+                    'Кто создал задачу': main_team,
+                    'Исполнитель': main_team,
+                    'Заказчик': client,
+                    'Приоритет': priority,
+                    'RICE': "", 
+                    'Оценка (SP)': estimate,
+                    'Reach': reach_val,         
+                    'Impact': impact_val,       
+                    'Confidence': conf_val_num, 
+                    'Тип': 'Own Task',
+                    'Start date': str_start,
+                    'End date': str_end,
+                    'ID': new_task_id(),
+                    'Автодаты': ""
+                }]))
             
-            # Основная задача
-            rows_to_save.append(pd.DataFrame([{
-                'Берем': 'TRUE', 
-                'Название задачи': task_name,
-                'Описание': description,
-                'Кто создал задачу': main_team,
-                'Исполнитель': main_team,
-                'Заказчик': client,
-                'Приоритет': priority,
-                'RICE': "", 
-                'Оценка (SP)': estimate,
-                'Reach': reach_val,         
-                'Impact': impact_val,       
-                'Confidence': conf_val_num, 
-                'Тип': 'Own Task',
-                'Start date': str_start,
-                'End date': str_end
-            }]))
+                # Зависимость 1 (даты ставит автоплан, дедлайн = старт нашей задачи)
+                if dep1_team != "(Нет зависимости)" and dep1_team != main_team:
+                    if dep1_name:
+                        g_type = "Incoming Blocker" if dep1_type == "Блокер" else "Incoming Enabler"
+                        rows_to_save.append(pd.DataFrame([{
+                            'Берем': 'TRUE',
+                            'Название задачи': dep1_name,
+                            'Описание': dep1_desc,
+                            'Кто создал задачу': main_team,
+                            'Исполнитель': dep1_team,
+                            'Заказчик': client,
+                            'Приоритет': priority,
+                            'RICE': "", 
+                            'Оценка (SP)': "",
+                            'Reach': reach_val,         
+                            'Impact': impact_val,       
+                            'Confidence': conf_val_num, 
+                            'Тип': g_type,
+                            'Start date': "",
+                            'End date': "",
+                            'ID': new_task_id(),
+                            'Автодаты': ""
+                        }]))
             
-            # Зависимость 1 (Дедлайн для блокера/энейблера = старт нашей задачи)
-            if dep1_team != "(Нет зависимости)" and dep1_team != main_team:
-                if dep1_name:
-                    g_type = "Incoming Blocker" if dep1_type == "Блокер" else "Incoming Enabler"
-                    rows_to_save.append(pd.DataFrame([{
-                        'Берем': 'TRUE',
-                        'Название задачи': dep1_name,
-                        'Описание': dep1_desc,
-                        'Кто создал задачу': main_team,
-                        'Исполнитель': dep1_team,
-                        'Заказчик': client,
-                        'Приоритет': priority,
-                        'RICE': "", 
-                        'Оценка (SP)': "",
-                        'Reach': reach_val,         
-                        'Impact': impact_val,       
-                        'Confidence': conf_val_num, 
-                        'Тип': g_type,
-                        'Start date': "",
-                        'End date': str_start # Установили дедлайн равный дате старта основной задачи!
-                    }]))
+                # Зависимость 2 (даты ставит автоплан, дедлайн = старт нашей задачи)
+                if dep2_team != "(Нет зависимости)" and dep2_team != main_team:
+                    if dep2_name:
+                        g_type = "Incoming Blocker" if dep2_type == "Блокер" else "Incoming Enabler"
+                        rows_to_save.append(pd.DataFrame([{
+                            'Берем': 'TRUE',
+                            'Название задачи': dep2_name,
+                            'Описание': dep2_desc,
+                            'Кто создал задачу': main_team,
+                            'Исполнитель': dep2_team,
+                            'Заказчик': client,
+                            'Приоритет': priority,
+                            'RICE': "", 
+                            'Оценка (SP)': "",
+                            'Reach': reach_val,         
+                            'Impact': impact_val,       
+                            'Confidence': conf_val_num, 
+                            'Тип': g_type,
+                            'Start date': "",
+                            'End date': "",
+                            'ID': new_task_id(),
+                            'Автодаты': ""
+                        }]))
+
+                # === РАСЧЕТ ДАТ ===
+                values = [row_df.values.tolist()[0] for row_df in rows_to_save]
+                late_deps = schedule_new_rows(values, st.session_state.capacity_settings)
+                for row_df, row_values in zip(rows_to_save, values):
+                    row_df['Start date'], row_df['End date'], row_df['Автодаты'] = row_values[13], row_values[14], row_values[16]
+                if late_deps:
+                    st.session_state.schedule_warning = ("По плану своих команд не успевают к старту задачи: "
+                                                         + ", ".join(late_deps))
+
+                if priority == "P0 (Critical)":
+                    existing_p0_row = find_active_p0_row(main_team)
+                    if existing_p0_row is not None:
+                        st.session_state.p0_conflict = True
+                        st.session_state.p0_conflict_row = existing_p0_row
+                        st.session_state.pending_rows = rows_to_save
+                        st.rerun()
             
-            # Зависимость 2 (Дедлайн для блокера/энейблера = старт нашей задачи)
-            if dep2_team != "(Нет зависимости)" and dep2_team != main_team:
-                if dep2_name:
-                    g_type = "Incoming Blocker" if dep2_type == "Блокер" else "Incoming Enabler"
-                    rows_to_save.append(pd.DataFrame([{
-                        'Берем': 'TRUE',
-                        'Название задачи': dep2_name,
-                        'Описание': dep2_desc,
-                        'Кто создал задачу': main_team,
-                        'Исполнитель': dep2_team,
-                        'Заказчик': client,
-                        'Приоритет': priority,
-                        'RICE': "", 
-                        'Оценка (SP)': "",
-                        'Reach': reach_val,         
-                        'Impact': impact_val,       
-                        'Confidence': conf_val_num, 
-                        'Тип': g_type,
-                        'Start date': "",
-                        'End date': str_start # Установили дедлайн равный дате старта основной задачи!
-                    }]))
-
-            if priority == "P0 (Critical)":
-                current_df = load_data()
-                existing_p0 = current_df[
-                    (current_df['Исполнитель'] == main_team) & 
-                    (current_df['Приоритет'] == 'P0 (Critical)') &
-                    (current_df['Тип'] == 'Own Task') &
-                    (current_df['Берем'].astype(str).str.upper() == 'TRUE')
-                ]
-                if not existing_p0.empty:
+                try:
+                    conflict_row = save_rows(rows_to_save, p0_team=main_team if priority == "P0 (Critical)" else None)
+                except TimeoutError as e:
+                    st.error(f"❌ {e}")
+                    st.stop()
+                if conflict_row is not None:
+                    # P0 той же команды записали параллельно, пока мы заполняли форму
                     st.session_state.p0_conflict = True
+                    st.session_state.p0_conflict_row = conflict_row
                     st.session_state.pending_rows = rows_to_save
                     st.rerun()
-            
-            save_rows(rows_to_save)
-            st.success("Данные и даты успешно сохранены! (Зависимости получили дедлайн)")
-            st.rerun()
-
-# АНАЛИТИКА (ГРАФИКИ)
-try:
-    df_tasks = load_data()
-except:
-    df_tasks = pd.DataFrame()
-
-if not df_tasks.empty:
-    st.divider()
-    df_tasks_active = df_tasks[df_tasks['Берем'].astype(str).str.upper() == 'TRUE'].copy()
-    df_tasks_active['Оценка (SP)'] = pd.to_numeric(df_tasks_active['Оценка (SP)'], errors='coerce').fillna(0)
-    
-    cap_data = []
-    for d, s in st.session_state.capacity_settings.items():
-        total = s['people'] * s['days']
-        overhead = s.get('overhead', 20)
-        real_cap = round(total * (100 - overhead) / 100.0, 1)
-        cap_data.append({'Исполнитель': d, 'Real Capacity': real_cap})
-        
-    df_cap = pd.DataFrame(cap_data)
-    usage = df_tasks_active.groupby(['Исполнитель', 'Тип'])['Оценка (SP)'].sum().reset_index()
-    
-    st.subheader("📊 Загрузка команд (С учетом Threshold)")
-    fig = go.Figure()
-    
-    fig.add_trace(go.Bar(x=df_cap['Исполнитель'], y=df_cap['Real Capacity'], name='Real Capacity', marker_color='lightgrey', text=df_cap['Real Capacity'], textposition='auto'))
-    
-    for t in ['Own Task', 'Incoming Blocker', 'Incoming Enabler']:
-        sub = usage[usage['Тип'] == t]
-        if not sub.empty:
-            fig.add_trace(go.Bar(x=sub['Исполнитель'], y=sub['Оценка (SP)'], name=t, text=sub['Оценка (SP)'], textposition='inside'))
-            
-    fig.update_layout(barmode='overlay', title="Real Capacity vs Workload")
-    st.plotly_chart(fig, use_container_width=True)
-    
-    st.subheader("📋 Список всех задач")
-    st.dataframe(df_tasks, use_container_width=True)
+                st.success("Данные и даты успешно сохранены! (Зависимости получили дедлайн)")
+                st.rerun()
+
+    # МАССОВЫЙ ИМПОРТ
+    if st.session_state.get('import_message'):
+        st.success(st.session_state.pop('import_message'))
+    with st.expander("📥 Массовый импорт задач (CSV / XLSX)"):
+        render_bulk_import()
+
+    # АНАЛИТИКА (ГРАФИКИ)
+    try:
+        ensure_mirror_loaded()
+        has_tasks = count_tasks({}, None) > 0
+    except:
+        has_tasks = False
+
+    if has_tasks:
+        st.divider()
+
+        st.subheader("📊 Загрузка команд (С учетом Threshold)")
+        fig = build_workload_figure(mirror_version(), capacity_key(st.session_state.capacity_settings))
+        st.plotly_chart(fig, use_container_width=True)
+
+        data_issues = load_tasks(mirror_version())[1]
+        if data_issues:
+            st.caption("⚠️ Проверка данных в таблице: " + "; ".join(data_issues))
+
+        st.subheader("📋 Список всех задач")
+        render_task_browser()
+
+        with st.expander("🗓 Автоплан команды (capacity, приоритет, RICE, блокеры)"):
+            render_schedule_view()
+
+        with st.expander("🔗 Граф зависимостей (критический путь, резерв, связи)"):
+            render_dependency_view()
+
+    # АРХИВ КВАРТАЛОВ
+    if st.session_state.get('archive_message'):
+        st.success(st.session_state.pop('archive_message'))
+    with st.expander("🗄 Архив кварталов и история"):
+        render_quarter_archive()
+
+    # АДМИН-ПАНЕЛЬ (ТРАССИРОВКА)
+    if ADMIN_PANEL or st.query_params.get("admin") == "1":
+        with st.sidebar:
+            render_trace_panel()
+
+    finish_trace(st.session_state.trace)
+
+if __name__ == "__main__":
+    main()
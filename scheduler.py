@@ -0,0 +1,234 @@
+# Планировщик дат для planning_app.py: раскладывает задачи по таймлайнам команд с учётом
+# capacity (people — параллельные дорожки, overhead — замедление), приоритета, RICE и блокеров.
+#
+# Задача — словарь-спека:
+#   {'team': str, 'sp': число, 'priority': int (0 = P0), 'rice': float | None,
+#    'order': int (номер строки, последний тай-брейк), 'blockers': [id, ...],
+#    'fixed': (start, end) | None — даты, уже стоящие у задачи}
+#
+# Задачи с датами не двигаются: они первыми (по старту) занимают дорожки команды, а
+# list scheduling раскладывает только задачи без дат — после них.
+# Порядок: задачи идут по (приоритет, RICE по убыванию, строка), а блокеры — непосредственно
+# перед самой важной задачей, которую они блокируют. Размещение — list scheduling: задача встаёт
+# на дорожку команды, освободившуюся раньше всех, но не раньше конца своих блокеров. Даты —
+# смещения в днях от начала плана; SP = дней работы одного человека при нулевом overhead.
+#
+# Состояние плана хранит порядок, ключи и размещения. update() сравнивает новые спеки со старыми
+# и переразмещает только хвост затронутых команд (и зависящие от них задачи других команд),
+# а place_new() считает даты для ещё не сохранённых задач, не меняя состояние.
+import bisect
+import math
+
+DEFAULT_SP = 1  # длительность задач без оценки (входящие блокеры/энейблеры)
+MIN_EFFICIENCY = 0.05
+FULL_REBUILD_SHARE = 0.25  # при большем доле изменившихся задач план строится заново
+
+
+def team_lanes(settings):
+    return max(1, int(settings.get('people', 1)))
+
+
+def task_duration(sp, settings):
+    efficiency = max(MIN_EFFICIENCY, (100 - settings.get('overhead', 20)) / 100.0)
+    return max(1, math.ceil((sp or DEFAULT_SP) / efficiency))
+
+
+def _rank(spec):
+    if spec.get('fixed'):
+        return (-1, spec['fixed'][0], spec['order'])
+    rice = spec.get('rice')
+    return (spec['priority'], -rice if rice is not None else math.inf, spec['order'])
+
+
+# Задача с датами блокеры не ждёт, поэтому и не тянет их вперёд в порядке
+def _dependents(specs):
+    dependents = {}
+    for tid, spec in specs.items():
+        if spec.get('fixed'):
+            continue
+        for blocker in spec['blockers']:
+            if blocker in specs:
+                dependents.setdefault(blocker, []).append(tid)
+    return dependents
+
+
+# Ключ задачи без зависящих — (rank, 1); блокер получает ключ самой ранней зависящей
+# задачи с "0" и своим rank вместо "1", поэтому всегда сортируется перед ней
+def _sequence_key(tid, specs, dependents, keys, visiting=frozenset()):
+    if tid in keys:
+        return keys[tid]
+    rank = _rank(specs[tid])
+    candidates = [(rank, 1)]
+    for dep in dependents.get(tid, ()):
+        if dep not in visiting:  # цикл зависимостей — ребро игнорируется
+            candidates.append(_sequence_key(dep, specs, dependents, keys, visiting | {tid})[:-1] + (0, rank, 1))
+    key = min(candidates) if len(candidates) == 1 else min(candidates[1:])
+    keys[tid] = key
+    return key
+
+
+def _lane_state(state, team, upto):
+    # Время освобождения дорожек команды после задач, стоящих в порядке раньше позиции upto
+    free_at = [0] * team_lanes(state['capacity'].get(team, {}))
+    for tid in state['sequence'][:upto]:
+        if state['specs'][tid]['team'] == team:
+            _, end, lane = state['placed'][tid]
+            if lane < len(free_at):
+                free_at[lane] = max(free_at[lane], end)
+    return free_at
+
+
+def _place(spec, free_at, placed, capacity):
+    if spec.get('fixed'):
+        lane = min(range(len(free_at)), key=free_at.__getitem__)
+        free_at[lane] = max(free_at[lane], spec['fixed'][1])
+        return spec['fixed'][0], spec['fixed'][1], lane
+    ready = max([placed[b][1] for b in spec['blockers'] if b in placed], default=0)
+    lane = min(range(len(free_at)), key=free_at.__getitem__)
+    start = max(ready, free_at[lane])
+    end = start + task_duration(spec['sp'], capacity.get(spec['team'], {}))
+    free_at[lane] = end
+    return start, end, lane
+
+
+def build_schedule(specs, capacity_settings):
+    dependents = _dependents(specs)
+    keys = {}
+    for tid in specs:
+        _sequence_key(tid, specs, dependents, keys)
+    sequence = sorted(specs, key=keys.__getitem__)
+    state = {
+        'specs': dict(specs), 'capacity': {team: dict(v) for team, v in capacity_settings.items()},
+        'dependents': dependents, 'keys': keys, 'sequence': sequence,
+        'sorted_keys': [keys[tid] for tid in sequence], 'placed': {},
+    }
+    lanes = {}
+    for tid in sequence:
+        spec = specs[tid]
+        if spec['team'] not in lanes:
+            lanes[spec['team']] = [0] * team_lanes(state['capacity'].get(spec['team'], {}))
+        state['placed'][tid] = _place(spec, lanes[spec['team']], state['placed'], state['capacity'])
+    return state
+
+
+# Переразмещение с позиции start: задачи пересчитываются, только если их команда "грязная"
+# (в ней что-то сдвинулось раньше по порядку) или сдвинулся один из их блокеров
+def _replay(state, start, dirty_teams, changed):
+    lanes = {team: _lane_state(state, team, start) for team in dirty_teams}
+    dirty_teams = set(dirty_teams)
+    placed = state['placed']
+    for i in range(start, len(state['sequence'])):
+        tid = state['sequence'][i]
+        spec = state['specs'][tid]
+        team = spec['team']
+        if team in dirty_teams:
+            free_at = lanes[team]
+        elif any(b in changed for b in spec['blockers']):
+            free_at = _lane_state(state, team, i)
+        else:
+            continue
+        old = placed.get(tid)
+        placed[tid] = _place(spec, free_at, placed, state['capacity'])
+        if placed[tid] != old:
+            changed.add(tid)
+            if team not in dirty_teams:
+                dirty_teams.add(team)
+                lanes[team] = free_at
+
+
+def _remove(state, tid):
+    pos = bisect.bisect_left(state['sorted_keys'], state['keys'][tid])
+    while state['sequence'][pos] != tid:
+        pos += 1
+    del state['sequence'][pos]
+    del state['sorted_keys'][pos]
+    del state['keys'][tid]
+    state['placed'].pop(tid, None)
+    return pos
+
+
+def _insert(state, tid):
+    key = state['keys'][tid]
+    pos = bisect.bisect_right(state['sorted_keys'], key)
+    state['sequence'].insert(pos, tid)
+    state['sorted_keys'].insert(pos, key)
+    return pos
+
+
+# Дифф спек со старым состоянием: удалённые и изменённые задачи вынимаются из порядка,
+# новые и изменённые вставляются по ключу, затем переразмещается хвост с самой ранней позиции.
+# Задачи, у которых из-за новых связей сменился ключ (блокер стал нужен более важной задаче), переезжают.
+# Возвращает новое состояние: при смене capacity или массовых изменениях — построенное заново.
+def update_schedule(state, specs, capacity_settings):
+    capacity = {team: dict(v) for team, v in capacity_settings.items()}
+    if state is None or capacity != state['capacity']:
+        return build_schedule(specs, capacity_settings)
+
+    old_specs = state['specs']
+    removed = [tid for tid in old_specs if tid not in specs or specs[tid] != old_specs[tid]]
+    added = [tid for tid in specs if tid not in old_specs or specs[tid] != old_specs[tid]]
+    if not removed and not added:
+        return state
+    if len(removed) + len(added) > FULL_REBUILD_SHARE * max(len(specs), 1):
+        return build_schedule(specs, capacity_settings)
+
+    dependents = _dependents(specs)
+    keys = {}
+    touched = set(removed) | set(added)
+    # Ключи меняются только у задач, от которых (транзитивно) зависят изменившиеся
+    stack = [b for tid in touched for b in old_specs.get(tid, {}).get('blockers', []) + specs.get(tid, {}).get('blockers', [])]
+    while stack:
+        tid = stack.pop()
+        if tid in specs and tid in state['keys'] and tid not in touched:
+            if _sequence_key(tid, specs, dependents, keys) != state['keys'][tid]:
+                touched.add(tid)
+                removed.append(tid)
+                added.append(tid)
+                stack.extend(specs[tid]['blockers'])
+
+    dirty_teams, changed = set(), set(touched)
+    start = len(state['sequence'])
+    for tid in removed:
+        if tid in state['keys']:
+            start = min(start, _remove(state, tid))
+            dirty_teams.add(old_specs[tid]['team'])
+    state['specs'] = dict(specs)
+    state['dependents'] = dependents
+    for tid in added:
+        state['keys'][tid] = _sequence_key(tid, specs, dependents, keys)
+    for tid in added:
+        start = min(start, _insert(state, tid))
+        dirty_teams.add(specs[tid]['team'])
+
+    _replay(state, start, dirty_teams, changed)
+    return state
+
+
+# Даты для новых (ещё не сохранённых) задач относительно текущего плана. Новые задачи встают
+# в порядок по своему ключу; существующие задачи ниже по приоритету уступят им место уже при
+# следующем update_schedule(), когда строки появятся в данных. Состояние не меняется.
+def place_new(state, new_specs):
+    specs = dict(state['specs'])
+    specs.update(new_specs)
+    dependents = _dependents(specs)
+    keys = {}
+    new_keys = {tid: _sequence_key(tid, specs, dependents, keys) for tid in new_specs}
+
+    placed = dict(state['placed'])
+    result = {}
+    for tid in sorted(new_specs, key=new_keys.__getitem__):
+        spec = new_specs[tid]
+        pos = bisect.bisect_right(state['sorted_keys'], new_keys[tid])
+        free_at = _lane_state(state, spec['team'], pos)
+        # Новые задачи той же команды, вставленные раньше по порядку, тоже занимают дорожки
+        for other, (_, end, lane) in result.items():
+            if new_specs[other]['team'] == spec['team'] and new_keys[other] < new_keys[tid] and lane < len(free_at):
+                free_at[lane] = max(free_at[lane], end)
+        placed[tid] = result[tid] = _place(spec, free_at, placed, state['capacity'])
+    return {tid: (start, end) for tid, (start, end, _) in result.items()}
+
+
+# Задачи, которые не помещаются в квартал команды (дней на человека из capacity)
+def over_capacity(state):
+    return {tid for tid, (_, end, _) in state['placed'].items()
+            if end > state['capacity'].get(state['specs'][tid]['team'], {}).get('days', math.inf)}